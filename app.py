@@ -4,35 +4,111 @@ import configparser
 import dash
 import dash_bootstrap_components as dbc
 import numpy as np
+import os
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.io as pio
+import pyanalytics
+import pycache
+import pyexport
+import pydata
+import pyfunc
+import pymetrics
+import pyspatial
 import pytemplate
-from dash import dcc, html, Input, Output, State
-from pathlib import Path
-
-# FUNCTION NOT GRAPH
-def clean_table(df):
-    """Replace 8888 and 9999 values to np.nan"""
-    df[df == 8888] = np.nan
-    df[df == 9999] = np.nan
-
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from dash import dcc, html, Input, Output, State, Patch, no_update
 
 # PARSE CONFIG
 CONFIG_PATH = "config.ini"
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
 
-# DATABASE CONFIGURATION/VARS
-FOLDER_BMKG = Path(config["PATH BMKG DATABASE"]["FOLDER_BMKG"])
-FILE_NAME_BMKG = config["PATH BMKG DATABASE"]["FILE_NAME_BMKG"]
-FILE_NAME_BMKG_COMPLETENESS = config["PATH BMKG DATABASE"][
-    "FILE_NAME_BMKG_COMPLETENESS"
-]
-
 # PLOTLY CONFIGURATION/VARS
 EMPTY_FIG = pytemplate.emtpy_fig
 SELECTED_MAX = int(config["PLOTLY"]["SELECTED_MAX"])
+STREAM_BATCH = int(config["PLOTLY"]["STREAM_BATCH"])
+STREAM_INTERVAL_MS = 50
+WEBGL_MIN_TRACES = int(config["PLOTLY"]["WEBGL_MIN_TRACES"])
+DOWNSAMPLE_POINTS = int(config["PLOTLY"]["DOWNSAMPLE_POINTS"])
+DOWNSAMPLE_METHOD = config["PLOTLY"]["DOWNSAMPLE_METHOD"]
+AGGREGATE_MIN_POINTS = int(config["PLOTLY"]["AGGREGATE_MIN_POINTS"])
+pio.json.config.default_engine = config["PLOTLY"]["JSON_ENGINE"]
+
+# SPATIAL INDEX
+GRID_CELL_DEG = float(config["SPATIAL"]["GRID_CELL_DEG"])
+MAP_MAX_POINTS = int(config["SPATIAL"]["MAP_MAX_POINTS"])
+NEAREST_N = min(int(config["SPATIAL"]["NEAREST_N"]), SELECTED_MAX)
+
+# CONCURRENCY
+FIGURE_THREADS = int(config["CONCURRENCY"]["FIGURE_THREADS"])
+figure_pool = ThreadPoolExecutor(
+    max_workers=FIGURE_THREADS, thread_name_prefix="figure"
+)
+
+
+def _after_fork():
+    """New figure pool in background callback jobs (see pydata._after_fork)."""
+    global figure_pool
+    figure_pool = ThreadPoolExecutor(
+        max_workers=FIGURE_THREADS, thread_name_prefix="figure"
+    )
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+# BACKGROUND CALLBACKS
+def create_background_manager(name, directory):
+    """Background callback manager from its config name: diskcache or none."""
+    if name == "none":
+        return None
+    if name == "diskcache":
+        import diskcache
+
+        return dash.DiskcacheManager(diskcache.Cache(directory))
+    raise ValueError(f"unknown background manager: {name}")
+
+
+background_manager = create_background_manager(
+    config["CONCURRENCY"]["BACKGROUND"], config["CONCURRENCY"]["BACKGROUND_CACHE_DIR"]
+)
+if background_manager is None:
+    BACKGROUND_OPTIONS = {}
+    PAIRWISE_BACKGROUND_OPTIONS = {}
+else:
+    BACKGROUND_OPTIONS = dict(
+        background=True,
+        manager=background_manager,
+        running=[(Output("button-main", "disabled"), True, False)],
+        cancel=[Input("stat-picker", "value"), Input("parameter-picker", "value")],
+    )
+    # the pairwise matrix follows the plot: a running job is cancelled only
+    # when its own callback fires again, button-main stays enabled
+    PAIRWISE_BACKGROUND_OPTIONS = dict(background=True, manager=background_manager)
+
+# FIGURE CACHE
+FIGURE_BACKEND = config["CACHE"]["FIGURE_BACKEND"]
+if background_manager is not None and FIGURE_BACKEND == "memory":
+    # every background job is a forked process, its memory cache dies with it
+    warnings.warn(
+        "FIGURE_BACKEND = memory is not shared with background jobs, "
+        "using filesystem"
+    )
+    FIGURE_BACKEND = "filesystem"
+figure_cache = pycache.FigureCache(
+    pycache.create_backend(
+        FIGURE_BACKEND,
+        max_bytes=int(float(config["CACHE"]["FIGURE_CACHE_MB"]) * 1024**2),
+        ttl=int(config["CACHE"]["FIGURE_TTL"]),
+        directory=config["CACHE"]["FIGURE_CACHE_DIR"],
+        url=config["CACHE"]["REDIS_URL"],
+    ),
+    # every memoized figure takes the stations first
+    version=lambda stations, *_: pydata.data_version(stations),
+)
 
 # DASH CONFIGURATION/VARS
 CONFIG_DCC_GRAPH = {"modeBarButtonsToRemove": ["toImage"]}
@@ -46,23 +122,57 @@ APP_TITLE_HEAD = [
 ]
 APP_UPDATE_TITLE = "🤔🤔🤔🤔".lower()
 
-# SETUP PLOTLY TEMPLATE
-pio.templates.default = pytemplate.hktemplate
+# PLOTLY TEMPLATE IS SET UP ON FIRST FIGURE (pytemplate.setup_template)
 
-# PATH DATABASE
-FILE_BMKG = FOLDER_BMKG / FILE_NAME_BMKG
-FILE_COMPLETENESS = FOLDER_BMKG / FILE_NAME_BMKG_COMPLETENESS
+# METADATA DATABASE (READ ON FIRST USE)
+_from_metadata = {}
+
+
+def from_metadata(build):
+    """Return build(metadata_files), rebuilt only when the metadata changes."""
+    metadata_files = pydata.read_metadata()
+    cached = _from_metadata.get(build)
+    if cached is None or cached[0] is not metadata_files:
+        cached = (metadata_files, build(metadata_files))
+        _from_metadata[build] = cached
+    return cached[1]
 
-# READ METADATA DATABASE
-with pd.HDFStore(FILE_BMKG, mode="r") as store:
-    metadata_files = store.get("/metadata/files")
 
 # PLOTLY OPTIONS
 # DROPDOWN STATIONS
-options_stations = [
-    {"label": f"{stat_id} - {stat_name}".lower(), "value": stat_id}
-    for stat_id, stat_name in zip(metadata_files.index, metadata_files["Nama Stasiun"])
-]
+def _label_station(metadata_files):
+    return {
+        stat_id: f"{stat_id} - {stat_name}".lower()
+        for stat_id, stat_name in zip(
+            metadata_files.index, metadata_files["Nama Stasiun"]
+        )
+    }
+
+
+def get_label_station():
+    return from_metadata(_label_station)
+
+
+def get_options_stations():
+    return [
+        {"label": stat_label, "value": stat_id}
+        for stat_id, stat_label in get_label_station().items()
+    ]
+
+
+# STATION INDEX (MAP VIEWPORT, NEAREST STATIONS)
+def _station_index(metadata_files):
+    return pyspatial.StationIndex(
+        metadata_files.index,
+        metadata_files.Lintang,
+        metadata_files.Bujur,
+        cell_deg=GRID_CELL_DEG,
+    )
+
+
+def get_station_index():
+    return from_metadata(_station_index)
+
 
 # DROPDOWN PARAMETER
 LABEL_PARAMETER_ABBR = "Tn Tx Tavg RH_avg RR ss ff_x ddd_x ff_avg ddd_car".split()
@@ -81,17 +191,37 @@ options_parameter = [
     for par_abbr, par_name in label_parameter.items()
 ]
 
+# AGGREGATE LEVEL
+LABEL_LEVEL = {"daily": "harian", "monthly": "bulanan", "yearly": "tahunan"}
+
+
+def xaxis_title(parameter, level):
+    if level == "daily":
+        return "<b>📅 tanggal</b>"
+    method = pydata.aggregate_method(parameter)
+    return f"<b>📅 tanggal ({LABEL_LEVEL[level]}, {method})</b>"
+
+
 # FIGURE GENERATOR
 # GRAPH MAP
-def figure_map():
+def map_points(metadata_files, positions):
+    """lat, lon, text and customdata of the map trace for index positions."""
+    station_index = get_station_index()
+    ids = station_index.ids[positions]
+    return dict(
+        lat=station_index.lat[positions],
+        lon=station_index.lon[positions],
+        text=metadata_files.loc[ids, "Nama Stasiun"].str.lower().to_numpy(),
+        customdata=ids,
+    )
+
+
+def figure_map(metadata_files):
+    pytemplate.setup_template()
+    # WHOLE NETWORK, THINNED TO MAP_MAX_POINTS UNTIL THE MAP IS MOVED
+    positions = pyspatial.thin(np.arange(len(get_station_index())), MAP_MAX_POINTS)
     data_map = [
-        go.Scattermapbox(
-            lat=metadata_files.Lintang,
-            lon=metadata_files.Bujur,
-            text=metadata_files["Nama Stasiun"].str.lower(),
-            customdata=metadata_files.index,
-            name="stasiun",
-        ),
+        go.Scattermapbox(**map_points(metadata_files, positions), name="stasiun"),
     ]
     layout_map = go.Layout(
         clickmode="event+select",
@@ -109,27 +239,61 @@ def figure_map():
             style="open-street-map",
         ),
         dragmode="pan",
+        uirevision="map",
     )
     return go.Figure(data_map, layout_map)
 
 
 # FIGURE SCATTER PARAMETER
-def figure_with_parameter(stations, parameter):
+def series_downsampled(stations, parameter, start=None, end=None, level="daily"):
+    """List of (x, y) of stations within [start, end] at aggregate `level`,
+    downsampled for plotting."""
+    with pymetrics.span("read_series"):
+        stations_series = pydata.read_stations_series(stations, parameter, level=level)
+    xy = []
+    with pymetrics.span("downsample"):
+        for stat_id in stations:
+            series = stations_series[stat_id].loc[start:end]
+            x, y = pyfunc.downsample(
+                series.index.to_numpy(),
+                series.to_numpy(),
+                DOWNSAMPLE_POINTS,
+                DOWNSAMPLE_METHOD,
+            )
+            xy.append((x, y))
+    return xy
+
+
+def traces_parameter(stations, parameter, level="daily", webgl=False):
+    """Scatter traces as encoded dicts (see pyfunc.encode_trace), built
+    without plotly validation of the large arrays."""
+    label_station = get_label_station()
     data = []
-    for stat_id in stations:
-        with pd.HDFStore(FILE_BMKG, mode="r") as store:
-            table = store.get(f"/stations/sta{stat_id}")
-            clean_table(table)
-        name = f'{stat_id} - {metadata_files.loc[stat_id, "Nama Stasiun"]}'.lower()
+    xy = series_downsampled(stations, parameter, level=level)
+    for stat_id, (x, y) in zip(stations, xy):
+        name = label_station[stat_id]
         emoji = label_parameter[parameter].split()[0]
-        data.append(
-            go.Scatter(
-                x=table.index,
-                y=table.loc[:, parameter],
-                name=name,
-                hovertemplate=f"{emoji}: %{{y}}",
-            )
+        trace = dict(
+            type="scattergl" if webgl else "scatter",
+            x=x,
+            y=y,
+            name=name,
+            hovertemplate=f"{emoji}: %{{y}}",
+        )
+        data.append(pyfunc.encode_trace(trace))
+    return data
+
+
+@figure_cache.memoize
+@pymetrics.timed("figure_parameter")
+def figure_with_parameter(stations, parameter, level=None, webgl=False):
+    pytemplate.setup_template()
+    stations = sorted(stations)  # traces in the order of the cache key
+    if level is None:
+        level = pydata.select_level(
+            stations, parameter, min_points=AGGREGATE_MIN_POINTS
         )
+    data = traces_parameter(stations, parameter, level, webgl)
 
     title = f"<b>📈 Grafik {label_parameter[parameter].split('(')[0]}</b>".lower()
 
@@ -140,42 +304,128 @@ def figure_with_parameter(stations, parameter):
             pad=dict(t=-25),
         ),
         height=300,
-        xaxis=dict(title="<b>📅 tanggal</b>"),
+        xaxis=dict(title=xaxis_title(parameter, level)),
         yaxis=dict(title=f"<b>{label_parameter[parameter]}</b>"),
         margin=dict(t=65),
         dragmode="zoom",
         showlegend=True,
+        uirevision=f"{parameter}-{stations}",
     )
 
-    fig = go.Figure(data, layout)
+    fig = go.Figure(layout=layout).to_dict()
+    fig["data"] = data
+
+    return fig
+
+
+# FIGURE ANALYSIS
+LABEL_ANALYSIS = {
+    "rolling": "〰️ rata-rata bergerak",
+    "climatology": "📅 klimatologi bulanan",
+    "anomaly": "🌡️ anomali",
+}
+LABEL_MONTH = "jan feb mar apr mei jun jul agu sep okt nov des".split()
+
+
+@figure_cache.memoize
+@pymetrics.timed("figure_analysis")
+def figure_analysis(stations, parameter, analysis, window):
+    """Rolling mean, monthly climatology or smoothed anomaly of the daily
+    parameter of stations (see pyanalytics)."""
+    pytemplate.setup_template()
+    stations = sorted(stations)  # plotted stations are in click order
+    stations_series = pyanalytics.stations_analysis(
+        stations, parameter, analysis, window
+    )
+    label_station = get_label_station()
+    emoji = label_parameter[parameter].split()[0]
+
+    data = []
+    for stat_id in stations:
+        series = stations_series[stat_id]
+        if analysis == "climatology":
+            x, y = np.array(LABEL_MONTH), series.to_numpy()
+        else:
+            x, y = pyfunc.downsample(
+                series.index.to_numpy(),
+                series.to_numpy(),
+                DOWNSAMPLE_POINTS,
+                DOWNSAMPLE_METHOD,
+            )
+        trace = dict(
+            type="scatter",
+            x=x,
+            y=y,
+            name=label_station[stat_id],
+            mode="lines+markers" if analysis == "climatology" else "lines",
+            hovertemplate=f"{emoji}: %{{y:.2f}}",
+        )
+        data.append(pyfunc.encode_trace(trace))
+
+    name = label_parameter[parameter].split("(")[0]
+    title = f"<b>{LABEL_ANALYSIS[analysis]} {name}</b>".lower()
+    if analysis == "climatology":
+        xaxis_text = "<b>📅 bulan (rata-rata harian)</b>"
+    else:
+        xaxis_text = f"<b>📅 tanggal ({window} hari)</b>"
+
+    layout = go.Layout(
+        hovermode="x",
+        title=dict(text=title, pad=dict(t=-25)),
+        height=300,
+        xaxis=dict(title=xaxis_text),
+        yaxis=dict(
+            title=f"<b>{label_parameter[parameter]}</b>",
+            zeroline=analysis == "anomaly",
+        ),
+        margin=dict(t=65),
+        dragmode="zoom",
+        showlegend=True,
+        uirevision=f"{parameter}-{analysis}-{stations}",
+    )
+
+    fig = go.Figure(layout=layout).to_dict()
+    fig["data"] = data
 
     return fig
 
 
 # FIGURE COMPLETENESS
+def table_completeness(stations, parameter):
+    """Return (z, months) of completeness (%), one row per
+    station, from the prebuilt matrix or per-station reads as fallback."""
+    matrix = pydata.read_completeness_matrix(pydata.FILE_COMPLETENESS_MATRIX)
+    if matrix is not None and all(stat_id in matrix for stat_id in stations):
+        return matrix.take(stations, parameter)
+
+    stations_series = pydata.read_stations_completeness(stations, parameter)
+    with pymetrics.span("concat"):
+        table_percent = pd.concat(
+            [stations_series[stat_id].rename(f"{stat_id}") for stat_id in stations],
+            axis=1,
+        ).T
+    table_percent = table_percent.round(3) * 100
+    return table_percent.to_numpy(), table_percent.columns
+
+
+@figure_cache.memoize
+@pymetrics.timed("figure_completeness")
 def figure_completeness(stations, parameter):
-    table_percent = []
-    for stat_id in stations:
-        with pd.HDFStore(FILE_COMPLETENESS, mode="r") as store:
-            table = store.get(f"/stations/sta{stat_id}")
-            table = table[[parameter]].round(3) * 100
-            table.columns = [f"{stat_id}"]
-            table_percent.append(table)
-
-    table_percent = pd.concat(table_percent, axis=1).T.iloc[::-1]
-    table_percent_date = table_percent.copy()
-    table_percent_date.columns = table_percent_date.columns.strftime("%B %Y").str.lower()
-
-    data = go.Heatmap(
-        z=table_percent.to_numpy(),
-        x=table_percent.columns,
-        y=[
-            f'{stat_id} - {metadata_files.at[int(stat_id), "Nama Stasiun"]}'.lower()
-            for stat_id in table_percent.index
-        ],
+    pytemplate.setup_template()
+    stations = sorted(stations)  # patch_graph passes them in click order
+    z, months = table_completeness(stations, parameter)
+    stations = stations[::-1]
+    z = z[::-1]
+    label_station = get_label_station()
+    stations_label = [label_station[int(stat_id)] for stat_id in stations]
+
+    data = dict(
+        type="heatmap",
+        z=z,
+        x=months.to_numpy(),
+        y=stations_label,
         zmin=0,
         zmax=100,
-        customdata=table_percent_date.to_numpy(),
     )
 
     layout = go.Layout(
@@ -183,7 +433,7 @@ def figure_completeness(stations, parameter):
             text=f"<b>💯 Kelengkapan Data {label_parameter[parameter].split('(')[0]}</b>".lower(),
             pad=dict(t=-25),
         ),
-        height=300,
+        height=height_completeness(len(stations)),
         xaxis=dict(
             title={"text": "<b>📅 tanggal</b>"},
             showspikes=True,
@@ -191,11 +441,8 @@ def figure_completeness(stations, parameter):
         yaxis=dict(
             title={"text": "<b>🆔 ID Stasiun</b>".lower()},
             tickmode="array",
-            tickvals=[
-                f'{stat_id} - {metadata_files.at[int(stat_id), "Nama Stasiun"]}'.lower()
-                for stat_id in table_percent.index
-            ],
-            ticktext=table_percent.index,
+            tickvals=stations_label,
+            ticktext=[f"{stat_id}" for stat_id in stations],
             tickangle=-90,
             fixedrange=True,
         ),
@@ -203,7 +450,115 @@ def figure_completeness(stations, parameter):
         dragmode="zoom",
     )
 
-    return go.Figure(data, layout)
+    fig = go.Figure(layout=layout).to_dict()
+    fig["data"] = [pyfunc.encode_trace(data)]
+
+    return fig
+
+
+def height_completeness(n_stations):
+    return max(300, 100 + 15 * n_stations)
+
+
+# FIGURE PAIRWISE (STATION x STATION)
+LABEL_PAIRWISE = {
+    "pearson": "🔗 korelasi",
+    "rmsd": "📏 jarak (RMSD)",
+}
+LABEL_PAIRWISE_SCOPE = {
+    "plotted": "stasiun di grafik",
+    "all": "semua stasiun",
+}
+
+
+@figure_cache.memoize
+@pymetrics.timed("figure_pairwise")
+def figure_pairwise(stations, parameter, method):
+    """Correlation or RMSD of the daily parameter between every pair of
+    stations, over the days both have a value (see pyanalytics)."""
+    pytemplate.setup_template()
+    stations = sorted(stations)  # wmo ids are grouped by region
+    matrix = pyanalytics.stations_pairwise(stations, parameter, method)
+    label_station = get_label_station()
+    stations_label = [label_station[int(stat_id)] for stat_id in stations]
+    stations_text = [f"{stat_id}" for stat_id in stations]
+    emoji = LABEL_PAIRWISE[method].split()[0]
+
+    data = dict(
+        type="heatmap",
+        z=matrix.to_numpy(),
+        x=stations_label,
+        y=stations_label,
+        hovertemplate=f"%{{y}}<br>%{{x}}<br>{emoji}: %{{z:.2f}}<extra></extra>",
+    )
+    if method == "pearson":
+        data.update(zmin=-1, zmax=1, colorscale="RdBu", colorbar={"ticksuffix": ""})
+    else:
+        data.update(colorbar={"ticksuffix": ""})
+
+    axis = dict(
+        tickmode="array",
+        tickvals=stations_label,
+        ticktext=stations_text,
+        showticklabels=len(stations) <= 60,
+        showspikes=False,
+    )
+    name = label_parameter[parameter].split("(")[0]
+    layout = go.Layout(
+        title=dict(
+            text=f"<b>{LABEL_PAIRWISE[method]} {name} antar stasiun</b>".lower(),
+            pad=dict(t=-25),
+        ),
+        height=min(height_completeness(len(stations)), 900),
+        xaxis=dict(axis, title={"text": "<b>🆔 ID Stasiun</b>".lower()}),
+        yaxis=dict(
+            axis,
+            title={"text": "<b>🆔 ID Stasiun</b>".lower()},
+            autorange="reversed",
+            scaleanchor="x",
+        ),
+        hovermode="closest",
+        margin=dict(t=65),
+        dragmode="zoom",
+    )
+
+    fig = go.Figure(layout=layout).to_dict()
+    fig["data"] = [pyfunc.encode_trace(data)]
+
+    return fig
+
+
+# PARTIAL UPDATE
+def patch_graph(plotted, stations, parameter):
+    """Return (patch parameter, patch completeness, plotted) that turn the
+    plotted figures into the figures of `stations`. Only added/removed traces
+    are sent; the heatmap (one binary z array) is replaced in place."""
+    current = plotted["stations"]
+    removed = [i for i, stat_id in enumerate(current) if stat_id not in stations]
+    added = [stat_id for stat_id in stations if stat_id not in current]
+    order = [stat_id for stat_id in current if stat_id in stations] + added
+    if not removed and not added:
+        return no_update, no_update, plotted
+
+    patched_par = Patch()
+    for i in reversed(removed):
+        del patched_par["data"][i]
+    traces = traces_parameter(added, parameter, plotted["level"], plotted["webgl"])
+    for trace in traces:
+        patched_par["data"].append(trace)
+
+    fig_com = figure_completeness(order, parameter)
+    heatmap = fig_com["data"][0]
+    yaxis = fig_com["layout"]["yaxis"]
+    patched_com = Patch()
+    for key in ["x", "y", "z"]:
+        patched_com["data"][0][key] = heatmap[key]
+    patched_com["layout"]["yaxis"]["tickvals"] = yaxis["tickvals"]
+    patched_com["layout"]["yaxis"]["ticktext"] = yaxis["ticktext"]
+    patched_com["layout"]["height"] = fig_com["layout"]["height"]
+
+    plotted = {**plotted, "stations": order}
+    return patched_par, patched_com, plotted
 
 
 # DASH APPLICATION
@@ -216,152 +571,556 @@ app = dash.Dash(
         {"name": "viewport", "content": "width=device-width, initial-scale=1"},
     ],
 )
+server = app.server
 
-app.layout = dbc.Container(
-    [
-        dbc.Container(
-            [
-                html.H1(
-                    APP_TITLE_HEAD,
-                    className="text-center fw-bold fs-1 p-0",
-                    style={"cursor": "pointer"},
-                    id="tooltip-target",
-                ),
-                dbc.Tooltip(
-                    "my first dashboard projects! 🤘".lower(),
-                    target="tooltip-target",
-                    className="fw-bold",
-                    style={"letter-spacing": "3px"},
-                    placement="right",
-                ),
-                pytemplate.HTML_CREATEDBY,
-                pytemplate.HTML_INFO,
-                pytemplate.ALERT_DEMO,
-                dcc.Markdown(
-                    pytemplate.MD_TUTORIAL.lower(),
-                    style={"letter-spacing": "1px"},
-                ),
-            ],
-        ),
-        dcc.Graph(id="map-fig", figure=figure_map(), config=CONFIG_DCC_GRAPH),
-        dbc.Container(
-            [
-                dbc.Row(
-                    [
-                        dbc.Col(
-                            [
-                                html.P("🛖 st🅰️sℹ️un 🏘️", className="fs-2"),
-                                dcc.Dropdown(
-                                    options=options_stations,
-                                    value=[96753, 96731, 96791, 97699, 97682],
-                                    multi=True,
-                                    clearable=False,
-                                    id="stat-picker",
+
+def metrics_gauges():
+    """Cache counters, read when /metrics is scraped."""
+    info = pydata.cache_info()
+    station = {"cache": "station"}
+    for key in ["hits", "misses", "evictions"]:
+        yield f"bmkg_cache_{key}_total", "counter", station, info[key]
+    yield "bmkg_cache_items", "gauge", station, info["items"]
+    yield "bmkg_cache_bytes", "gauge", station, info["bytes"]
+    info = pyanalytics.cache_info()
+    analytics = {"cache": "analytics"}
+    for key in ["hits", "misses", "evictions"]:
+        yield f"bmkg_cache_{key}_total", "counter", analytics, info[key]
+    yield "bmkg_cache_items", "gauge", analytics, info["items"]
+    yield "bmkg_cache_bytes", "gauge", analytics, info["bytes"]
+    for key, value in figure_cache.info().items():
+        yield f"bmkg_cache_{key}_total", "counter", {"cache": "figure"}, value
+
+
+pymetrics.init_flask(server, metrics_gauges)
+pyexport.init_flask(server, LABEL_PARAMETER_ABBR)
+
+
+def serve_layout():
+    """Layout, built per page load so importing the app reads no data."""
+    return dbc.Container(
+        [
+            dbc.Container(
+                [
+                    html.H1(
+                        APP_TITLE_HEAD,
+                        className="text-center fw-bold fs-1 p-0",
+                        style={"cursor": "pointer"},
+                        id="tooltip-target",
+                    ),
+                    dbc.Tooltip(
+                        "my first dashboard projects! 🤘".lower(),
+                        target="tooltip-target",
+                        className="fw-bold",
+                        style={"letter-spacing": "3px"},
+                        placement="right",
+                    ),
+                    pytemplate.HTML_CREATEDBY,
+                    pytemplate.HTML_INFO,
+                    pytemplate.ALERT_DEMO,
+                    dcc.Markdown(
+                        pytemplate.MD_TUTORIAL.lower(),
+                        style={"letter-spacing": "1px"},
+                    ),
+                ],
+            ),
+            dcc.Graph(
+                id="map-fig", figure=from_metadata(figure_map), config=CONFIG_DCC_GRAPH
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.RadioItems(
+                            options=[
+                                {"label": "🖱️ pilih stasiun", "value": "select"},
+                                {"label": "📍 stasiun terdekat", "value": "nearest"},
+                            ],
+                            value="select",
+                            inline=True,
+                            id="map-mode",
+                        ),
+                        width="auto",
+                    ),
+                    dbc.Col(
+                        dbc.Input(
+                            type="number",
+                            value=NEAREST_N,
+                            min=1,
+                            max=SELECTED_MAX,
+                            step=1,
+                            size="sm",
+                            id="nearest-n",
+                        ),
+                        width=1,
+                    ),
+                ],
+                align="center",
+                justify="center",
+                className="mt-2",
+            ),
+            dbc.Container(
+                [
+                    dbc.Row(
+                        [
+                            dbc.Col(
+                                [
+                                    html.P("🛖 st🅰️sℹ️un 🏘️", className="fs-2"),
+                                    dcc.Dropdown(
+                                        options=get_options_stations(),
+                                        value=[96753, 96731, 96791, 97699, 97682],
+                                        multi=True,
+                                        clearable=False,
+                                        id="stat-picker",
+                                    ),
+                                ]
+                            ),
+                            html.Div(
+                                [
+                                    html.P("🧮 pa®️am3️⃣✖️er 🔢", className="fs-2"),
+                                    dcc.Dropdown(
+                                        options=options_parameter,
+                                        value="RR",
+                                        multi=False,
+                                        clearable=False,
+                                        id="parameter-picker",
+                                    ),
+                                ],
+                                className="col-4",
+                            ),
+                        ],
+                        className="mt-3",
+                    ),
+                    dbc.Row(
+                        [
+                            # html.Div(className="col"),
+                            dbc.Col(
+                                dbc.Button(
+                                    "🚿 Tampilkan 📈 Grafik 📊".lower(),
+                                    id="button-main",
+                                    color="primary",
+                                    size="lg",
+                                    className="float-center fw-bold",
                                 ),
-                            ]
+                                className="mt-4",
+                                width="auto",
+                            ),
+                        ],
+                        justify="center",
+                    ),
+                ],
+            ),
+            html.Hr(),
+            dcc.Loading(
+                [
+                    dcc.Graph(
+                        id="graph-all",
+                        figure=EMPTY_FIG,
+                        config=CONFIG_DCC_GRAPH,
+                    ),
+                    html.Div(
+                        [
+                            html.A(
+                                "⬇️ unduh csv",
+                                id="export-csv",
+                                className="me-3",
+                                download="",
+                            ),
+                            html.A(
+                                "⬇️ unduh parquet",
+                                id="export-parquet",
+                                download="",
+                            ),
+                        ],
+                        id="export-links",
+                        className="text-end",
+                        hidden=True,
+                    ),
+                    dcc.Store(id="store-graph-all"),
+                    dcc.Store(id="store-selected-max", data=SELECTED_MAX),
+                    dcc.Store(id="store-stream"),
+                    dcc.Interval(
+                        id="interval-stream",
+                        interval=STREAM_INTERVAL_MS,
+                        disabled=True,
+                    ),
+                ]
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.RadioItems(
+                            options=[
+                                {"label": label, "value": analysis}
+                                for analysis, label in LABEL_ANALYSIS.items()
+                            ],
+                            value="rolling",
+                            inline=True,
+                            id="analysis-mode",
                         ),
-                        html.Div(
+                        width="auto",
+                    ),
+                    dbc.Col(
+                        dbc.InputGroup(
                             [
-                                html.P("🧮 pa®️am3️⃣✖️er 🔢", className="fs-2"),
-                                dcc.Dropdown(
-                                    options=options_parameter,
-                                    value="RR",
-                                    multi=False,
-                                    clearable=False,
-                                    id="parameter-picker",
+                                dbc.Input(
+                                    type="number",
+                                    value=pyanalytics.ROLLING_WINDOW,
+                                    min=1,
+                                    max=pyanalytics.MAX_WINDOW,
+                                    step=1,
+                                    debounce=True,
+                                    id="analysis-window",
                                 ),
+                                dbc.InputGroupText("hari"),
                             ],
-                            className="col-4",
+                            size="sm",
                         ),
-                    ],
-                    className="mt-3",
-                ),
-                dbc.Row(
-                    [
-                        # html.Div(className="col"),
-                        dbc.Col(
-                            dbc.Button(
-                                "🚿 Tampilkan 📈 Grafik 📊".lower(),
-                                id="button-main",
-                                color="primary",
-                                size="lg",
-                                className="float-center fw-bold",
-                            ),
-                            className="mt-4",
-                            width="auto",
+                        width=2,
+                    ),
+                ],
+                align="center",
+                justify="center",
+                className="mt-2",
+            ),
+            dcc.Loading(
+                dcc.Graph(
+                    id="graph-analysis",
+                    figure=EMPTY_FIG,
+                    config=CONFIG_DCC_GRAPH,
+                )
+            ),
+            html.Hr(),
+            dcc.Loading(
+                dcc.Graph(
+                    id="graph-completeness",
+                    figure=EMPTY_FIG,
+                    config=CONFIG_DCC_GRAPH,
+                )
+            ),
+            html.Hr(),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.RadioItems(
+                            options=[
+                                {"label": label, "value": method}
+                                for method, label in LABEL_PAIRWISE.items()
+                            ],
+                            value="pearson",
+                            inline=True,
+                            id="pairwise-method",
                         ),
-                    ],
-                    justify="center",
-                ),
-            ],
-        ),
-        html.Hr(),
-        dcc.Loading(
-            [
+                        width="auto",
+                    ),
+                    dbc.Col(
+                        dbc.RadioItems(
+                            options=[
+                                {"label": label, "value": scope}
+                                for scope, label in LABEL_PAIRWISE_SCOPE.items()
+                            ],
+                            value="plotted",
+                            inline=True,
+                            id="pairwise-scope",
+                        ),
+                        width="auto",
+                    ),
+                ],
+                align="center",
+                justify="center",
+            ),
+            dcc.Loading(
                 dcc.Graph(
-                    id="graph-all",
+                    id="graph-pairwise",
                     figure=EMPTY_FIG,
                     config=CONFIG_DCC_GRAPH,
                 )
-            ]
-        ),
-        html.Hr(),
-        dcc.Loading(
-            dcc.Graph(
-                id="graph-completeness",
-                figure=EMPTY_FIG,
-                config=CONFIG_DCC_GRAPH,
-            )
-        ),
-        html.Hr(),
-        dcc.Markdown(
-            "made with [Dash+Plotly](https://plotly.com)".lower(),
-            className="fs-4 text-center",
-        ),
-        pytemplate.HTML_FOOTER,
+            ),
+            html.Hr(),
+            dcc.Markdown(
+                "made with [Dash+Plotly](https://plotly.com)".lower(),
+                className="fs-4 text-center",
+            ),
+            pytemplate.HTML_FOOTER,
+        ],
+        className="p-3",
+    )
+
+
+app.layout = serve_layout
+
+
+# SELECTION SYNC (CLIENTSIDE, NO SERVER ROUND TRIP)
+app.clientside_callback(
+    """
+    function(selectedData, dropdownval, selectedMax, mapMode) {
+        const triggered = dash_clientside.callback_context.triggered;
+        const fromMap = triggered.some((t) => t.prop_id === "map-fig.selectedData");
+        if (fromMap && mapMode === "nearest") {
+            return dash_clientside.no_update;
+        }
+        let stations = dropdownval || [];
+        if (fromMap && selectedData) {
+            stations = selectedData.points.map((point) => point.customdata);
+        } else if (stations.length <= selectedMax) {
+            return dash_clientside.no_update;
+        }
+        return stations.slice(0, selectedMax);
+    }
+    """,
+    Output("stat-picker", "value"),
+    Input("map-fig", "selectedData"),
+    Input("stat-picker", "value"),
+    State("store-selected-max", "data"),
+    State("map-mode", "value"),
+    prevent_initial_call=True,
+)
+
+
+@app.callback(
+    Output("stat-picker", "value", allow_duplicate=True),
+    Input("map-fig", "clickData"),
+    [
+        State("map-mode", "value"),
+        State("nearest-n", "value"),
     ],
-    className="p-3",
+    prevent_initial_call=True,
+)
+@pymetrics.timed("callback_select_nearest")
+def select_nearest(clickData, map_mode, n_nearest):
+    if map_mode != "nearest" or clickData is None:
+        return no_update
+    point = clickData["points"][0]
+    n_nearest = min(int(n_nearest or NEAREST_N), SELECTED_MAX)
+    station_index = get_station_index()
+    positions = station_index.nearest(point["lat"], point["lon"], n_nearest)
+    return station_index.ids[positions].tolist()
+
+
+@app.callback(
+    Output("map-fig", "figure"),
+    Input("map-fig", "relayoutData"),
+    prevent_initial_call=True,
 )
+@pymetrics.timed("callback_refill_map")
+def refill_map(relayout):
+    """Send the stations inside the visible area (bounded by MAP_MAX_POINTS)."""
+    bounds = pyfunc.relayout_mapbox_bounds(relayout)
+    station_index = get_station_index()
+    if bounds is False or len(station_index) <= MAP_MAX_POINTS:
+        return no_update
+
+    positions = station_index.within_box(*bounds, limit=MAP_MAX_POINTS)
+    metadata_files = pydata.read_metadata()
+    patched = Patch()
+    for key, value in map_points(metadata_files, positions).items():
+        patched["data"][0][key] = value
+    return patched
 
 
 @app.callback(
     [
-        Output("stat-picker", "value"),
         Output("graph-all", "figure"),
         Output("graph-completeness", "figure"),
+        Output("store-graph-all", "data"),
+        Output("store-stream", "data"),
+        Output("interval-stream", "disabled"),
     ],
+    Input("button-main", "n_clicks"),
     [
-        Input("button-main", "n_clicks"),
-        Input("map-fig", "selectedData"),
+        State("stat-picker", "value"),
         State("parameter-picker", "value"),
-        Input("stat-picker", "value"),
+        State("store-graph-all", "data"),
     ],
     prevent_initial_call=True,
+    **BACKGROUND_OPTIONS,
 )
-def create_graph(_, selectedData, parameter, dropdownval):
-    ctx = dash.callback_context
-
-    fig_par = EMPTY_FIG
-    fig_com = EMPTY_FIG
-
-    if selectedData is not None:
-        stations = [point["customdata"] for point in selectedData["points"]]
-        stations = stations[:SELECTED_MAX] if len(stations) > SELECTED_MAX else stations
+@pymetrics.timed("callback_create_graph")
+def create_graph(_, stations, parameter, plotted):
+    stations = stations[:SELECTED_MAX] if len(stations) > SELECTED_MAX else stations
+    level = pydata.select_level(stations, parameter, min_points=AGGREGATE_MIN_POINTS)
+    webgl = len(stations) >= WEBGL_MIN_TRACES
 
-    stations = dropdownval if selectedData is None else stations
+    # a click also stops any stream in progress, `plotted` is what was sent
+    if (
+        plotted is not None
+        and plotted["parameter"] == parameter
+        and plotted["level"] == level
+        and plotted["webgl"] == webgl
+        and set(plotted["stations"]) & set(stations)
+        and len(set(stations) - set(plotted["stations"])) <= STREAM_BATCH
+    ):
+        return [*patch_graph(plotted, stations, parameter), None, True]
 
-    if ctx.triggered[0]["prop_id"] == "button-main.n_clicks":
-        stations = stations[:SELECTED_MAX] if len(stations) > SELECTED_MAX else stations
+    stations_plot = sorted(stations)  # same figure (and cache key) for any order
+    # many stations: send the first batch now, the rest with stream_graph
+    stations_plot, pending = stations_plot[:STREAM_BATCH], stations_plot[STREAM_BATCH:]
 
-        fig_par = figure_with_parameter(stations, parameter)
-        fig_com = figure_completeness(stations, parameter)
+    # station reads inside run on pydata.loader, a separate pool
+    future_par = pymetrics.pool_submit(
+        figure_pool, figure_with_parameter, stations_plot, parameter, level, webgl
+    )
+    future_com = pymetrics.pool_submit(
+        figure_pool, figure_completeness, stations_plot, parameter
+    )
+    fig_par, fig_com = future_par.result(), future_com.result()
+    plotted = {
+        "stations": stations_plot,
+        "parameter": parameter,
+        "level": level,
+        "webgl": webgl,
+    }
 
     return [
-        stations,
         fig_par,
         fig_com,
+        plotted,
+        pending or None,
+        not pending,
     ]
 
 
+# STREAMING: ONE BATCH PER TICK, THE TICK IS PAUSED WHILE A BATCH IS IN FLIGHT
+app.clientside_callback(
+    "function(n_intervals) { return true; }",
+    Output("interval-stream", "disabled", allow_duplicate=True),
+    Input("interval-stream", "n_intervals"),
+    prevent_initial_call=True,
+)
+
+
+@app.callback(
+    [
+        Output("graph-all", "figure", allow_duplicate=True),
+        Output("graph-completeness", "figure", allow_duplicate=True),
+        Output("store-graph-all", "data", allow_duplicate=True),
+        Output("store-stream", "data", allow_duplicate=True),
+        Output("interval-stream", "disabled", allow_duplicate=True),
+    ],
+    Input("interval-stream", "n_intervals"),
+    [
+        State("store-stream", "data"),
+        State("store-graph-all", "data"),
+    ],
+    prevent_initial_call=True,
+)
+@pymetrics.timed("callback_stream_graph")
+def stream_graph(_, pending, plotted):
+    """Append the next STREAM_BATCH stations to both graphs."""
+    if not pending or plotted is None:
+        return [no_update, no_update, no_update, None, True]
+
+    batch, pending = pending[:STREAM_BATCH], pending[STREAM_BATCH:]
+    fig_par, fig_com, plotted = patch_graph(
+        plotted, plotted["stations"] + batch, plotted["parameter"]
+    )
+    return [fig_par, fig_com, plotted, pending or None, not pending]
+
+
+@app.callback(
+    Output("graph-all", "figure", allow_duplicate=True),
+    Input("graph-all", "relayoutData"),
+    State("store-graph-all", "data"),
+    prevent_initial_call=True,
+)
+@pymetrics.timed("callback_zoom_graph")
+def zoom_graph(relayout, plotted):
+    """Replace traces with the finest level and resolution the visible window
+    needs."""
+    xrange = pyfunc.relayout_xrange(relayout)
+    if plotted is None or xrange is False:
+        return no_update
+
+    start, end = xrange
+    stations, parameter = plotted["stations"], plotted["parameter"]
+    level = pydata.select_level(stations, parameter, start, end, AGGREGATE_MIN_POINTS)
+    patched_fig = Patch()
+    patched_fig["layout"]["xaxis"]["title"]["text"] = xaxis_title(parameter, level)
+    xy = series_downsampled(stations, parameter, start, end, level)
+    for i, (x, y) in enumerate(xy):
+        patched_fig["data"][i]["x"] = pyfunc.encode_array(x)
+        patched_fig["data"][i]["y"] = pyfunc.encode_array(y)
+    return patched_fig
+
+
+# DOWNLOAD LINKS OF THE PLOTTED STATIONS (SEE pyexport)
+app.clientside_callback(
+    f"""
+    function(plotted) {{
+        if (!plotted) {{
+            return [true, "", ""];
+        }}
+        const query = "?stations=" + plotted.stations.join(",")
+            + "&parameters=" + plotted.parameter;
+        return [
+            false,
+            "{pyexport.ROUTE}" + query + "&format=csv",
+            "{pyexport.ROUTE}" + query + "&format=parquet",
+        ];
+    }}
+    """,
+    [
+        Output("export-links", "hidden"),
+        Output("export-csv", "href"),
+        Output("export-parquet", "href"),
+    ],
+    Input("store-graph-all", "data"),
+)
+
+
+@app.callback(
+    Output("graph-analysis", "figure"),
+    [
+        Input("store-graph-all", "data"),
+        Input("analysis-mode", "value"),
+        Input("analysis-window", "value"),
+    ],
+    prevent_initial_call=True,
+)
+@pymetrics.timed("callback_analysis_graph")
+def analysis_graph(plotted, analysis, window):
+    """Analysis of the stations plotted in graph-all, follows every batch."""
+    if plotted is None or window is None:
+        return no_update
+    if not pydata.is_numeric(plotted["parameter"]):
+        return EMPTY_FIG
+    # min/max of the input are not enforced on the server
+    try:
+        window = int(window)
+    except (TypeError, ValueError):
+        return no_update
+    if not 1 <= window <= pyanalytics.MAX_WINDOW:
+        return no_update
+    if analysis == "climatology":
+        window = pyanalytics.ROLLING_WINDOW  # unused, one cache key
+    return figure_analysis(plotted["stations"], plotted["parameter"], analysis, window)
+
+
+@app.callback(
+    Output("graph-pairwise", "figure"),
+    [
+        Input("store-graph-all", "data"),
+        Input("pairwise-method", "value"),
+        Input("pairwise-scope", "value"),
+    ],
+    prevent_initial_call=True,
+    **PAIRWISE_BACKGROUND_OPTIONS,
+)
+@pymetrics.timed("callback_pairwise_graph")
+def pairwise_graph(plotted, method, scope):
+    """Station x station matrix of the plotted parameter: plotted stations
+    (follows every batch) or the whole network (cached, see pyanalytics)."""
+    if plotted is None:
+        return no_update
+    if not pydata.is_numeric(plotted["parameter"]):
+        return EMPTY_FIG
+    if scope == "all":
+        stations = pydata.read_metadata().index.tolist()
+    else:
+        stations = plotted["stations"]
+    if len(stations) < 2:
+        return EMPTY_FIG
+    return figure_pairwise(stations, plotted["parameter"], method)
+
+
 if __name__ == "__main__":
     app.run_server(debug=DEBUG)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of pydata.clean_table against the previous implementation.
+
+Run from the repository root: `python benchmarks/bench_clean.py`.
+"""
+
+import argparse
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from pydata import clean_table  # noqa: E402
+
+PARAMETERS = "Tn Tx Tavg RH_avg RR ss ff_x ddd_x ff_avg ddd_car".split()
+
+
+def clean_table_legacy(df):
+    """Replace 8888 and 9999 values to np.nan"""
+    df[df == 8888] = np.nan
+    df[df == 9999] = np.nan
+
+
+def make_table(n_days, ratio_sentinel=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(0, 40, (n_days, len(PARAMETERS))).round(1)
+    is_sentinel = rng.random(values.shape) < ratio_sentinel
+    values[is_sentinel] = rng.choice([8888.0, 9999.0], is_sentinel.sum())
+    index = pd.date_range("1980-01-01", periods=n_days, freq="D")
+    return pd.DataFrame(values, index=index, columns=PARAMETERS)
+
+
+def bench(func, table, columns, repeat, number):
+    def run():
+        df = table[columns].copy()
+        func(df)
+
+    def copy_only():
+        table[columns].copy()
+
+    best = min(timeit.repeat(run, repeat=repeat, number=number))
+    base = min(timeit.repeat(copy_only, repeat=repeat, number=number))
+    return (best - base) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    table = make_table(args.years * 365)
+
+    expected = table.copy()
+    clean_table_legacy(expected)
+    result = table.copy()
+    clean_table(result)
+    pd.testing.assert_frame_equal(result, expected)
+
+    print(f"table: {table.shape[0]} rows x {table.shape[1]} columns")
+    for label, columns in [("all columns", PARAMETERS), ("one column", ["RR"])]:
+        legacy = bench(clean_table_legacy, table, columns, args.repeat, args.number)
+        current = bench(clean_table, table, columns, args.repeat, args.number)
+        print(
+            f"{label:>12}: legacy {legacy * 1e3:8.3f} ms | "
+            f"clean_table {current * 1e3:8.3f} ms | x{legacy / current:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,720 @@
+# -*- coding: utf-8 -*-
+"""Load test of the Dash server with replayed dashboard sessions.
+
+Every virtual user runs a session against `/_dash-update-component` like a
+browser would: a lasso selection on the map, a dropdown edit (one station
+added or removed), a parameter change or a "nearest stations" click, each
+followed by a click on the button (create_graph), the stream ticks of the
+remaining batches (stream_graph), the analysis and pairwise graphs;
+sometimes a zoom (zoom_graph). Station counts of selections are drawn from
+--selected.
+
+Without --url, a synthetic database is generated (see synthetic.py) and
+`gunicorn app:server` is started in its folder with --workers/--threads.
+Every concurrency level (--users) runs --duration seconds after a warm-up
+and reports p50/p95/p99 latency per callback and per user action, request
+throughput, errors and RSS of every worker (needs psutil, sampled during
+the run).
+
+    python benchmarks/bench_load.py --stations 200 --users 1 4 16 \\
+        --workers 2 --threads 4 --set CACHE.FIGURE_BACKEND=none \\
+        --output load.json
+
+Against a running server (memory with the PID of the gunicorn master):
+
+    python benchmarks/bench_load.py --url http://127.0.0.1:8000 --pid 1234
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from configparser import ConfigParser
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import synthetic  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# SHARE OF USER ACTIONS IN A SESSION
+ACTIONS = {
+    "lasso": 0.35,
+    "dropdown": 0.3,
+    "parameter": 0.15,
+    "nearest": 0.1,
+    "zoom": 0.1,
+}
+# SERVER CALLBACKS, FOUND IN /_dash-dependencies BY (FIRST INPUT, FIRST OUTPUT)
+CALLBACKS = {
+    "create_graph": ("button-main.n_clicks", "graph-all.figure"),
+    "stream_graph": ("interval-stream.n_intervals", "graph-all.figure"),
+    "select_nearest": ("map-fig.clickData", "stat-picker.value"),
+    "zoom_graph": ("graph-all.relayoutData", "graph-all.figure"),
+    "analysis_graph": ("store-graph-all.data", "graph-analysis.figure"),
+    "pairwise_graph": ("store-graph-all.data", "graph-pairwise.figure"),
+}
+# STREAM TICKS PER CLICK AT MOST, LIKE A USER WAITING FOR THE LAST BATCH
+MAX_STREAM_TICKS = 20
+# ZOOM WINDOWS: START YEAR (INSIDE 30 SYNTHETIC YEARS) AND LENGTH IN DAYS
+ZOOM_YEARS = (1995, 2022)
+ZOOM_DAYS = [31, 182, 730]
+
+
+# DASH PROTOCOL
+def _outputs(output):
+    """`outputs` of a request for the `output` string of a dependency."""
+    if not output.startswith(".."):
+        component, prop = output.split(".", 1)
+        return {"id": component, "property": prop.split("@")[0]}
+    return [_outputs(item) for item in output[2:-2].split("...")]
+
+
+def _find_props(node, component):
+    """Props of component `component` in the layout tree."""
+    if isinstance(node, dict):
+        props = node.get("props")
+        if isinstance(props, dict) and props.get("id") == component:
+            return props
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        props = _find_props(child, component)
+        if props is not None:
+            return props
+    return None
+
+
+class Client:
+    """Keep-alive HTTP connection of one virtual user."""
+
+    def __init__(self, url, timeout=120):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._connection = None
+
+    def request(self, method, path, body=None):
+        """Return (status, body bytes), reconnecting once if the server
+        closed the connection."""
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        data = None if body is None else json.dumps(body).encode()
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout
+                )
+            try:
+                self._connection.request(method, self.prefix + path, data, headers)
+                response = self._connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def get_json(self, path):
+        status, data = self.request("GET", path)
+        if status != 200:
+            raise RuntimeError(f"GET {path}: {status}")
+        return json.loads(data)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class Dashboard:
+    """What a session needs to know about the app: server callbacks, map
+    points and parameters (from /_dash-dependencies and /_dash-layout)."""
+
+    def __init__(self, client):
+        dependencies = [
+            dependency
+            for dependency in client.get_json("/_dash-dependencies")
+            if dependency.get("clientside_function") is None
+        ]
+        self.callbacks = {}
+        for name, first in CALLBACKS.items():
+            for dependency in dependencies:
+                inputs = dependency["inputs"]
+                outputs = _outputs(dependency["output"])
+                output = outputs[0] if isinstance(outputs, list) else outputs
+                if inputs and first == (
+                    f"{inputs[0]['id']}.{inputs[0]['property']}",
+                    f"{output['id']}.{output['property']}",
+                ):
+                    self.callbacks[name] = dependency
+                    break
+            else:
+                raise RuntimeError(f"callback not found: {name}")
+
+        layout = client.get_json("/_dash-layout")
+        points = _find_props(layout, "map-fig")["figure"]["data"][0]
+        self.stations = list(points["customdata"])
+        self.lat = dict(zip(self.stations, points["lat"]))
+        self.lon = dict(zip(self.stations, points["lon"]))
+        self.parameters = [
+            option["value"]
+            for option in _find_props(layout, "parameter-picker")["options"]
+        ]
+        self.analyses = [
+            option["value"]
+            for option in _find_props(layout, "analysis-mode")["options"]
+        ]
+        self.pairwise = [
+            option["value"]
+            for option in _find_props(layout, "pairwise-method")["options"]
+        ]
+
+    def body(self, name, values, changed):
+        """Request body of callback `name`; `values` {"id.property": value}."""
+        dependency = self.callbacks[name]
+
+        def items(dependencies):
+            return [
+                {
+                    "id": item["id"],
+                    "property": item["property"],
+                    "value": values.get(f"{item['id']}.{item['property']}"),
+                }
+                for item in dependencies
+            ]
+
+        return {
+            "output": dependency["output"],
+            "outputs": _outputs(dependency["output"]),
+            "inputs": items(dependency["inputs"]),
+            "state": items(dependency["state"]),
+            "changedPropIds": [changed],
+        }
+
+
+# SESSIONS
+class Session:
+    """Dashboard state of one virtual user and its actions, each a chain of
+    callback requests recorded in `stats`."""
+
+    def __init__(self, client, dashboard, stats, selected, rng):
+        self.client = client
+        self.dashboard = dashboard
+        self.stats = stats
+        self.selected = selected
+        self.rng = rng
+        self.stations = []
+        self.parameter = rng.choice(dashboard.parameters)
+        self.analysis = rng.choice(dashboard.analyses)
+        self.pairwise = rng.choice(dashboard.pairwise)
+        self.plotted = None
+        self.pending = None
+        self.n_clicks = 0
+
+    def _post(self, path, body):
+        try:
+            status, data = self.client.request("POST", path, body)
+        except (OSError, http.client.HTTPException):
+            return None, b"", {}
+        return status, data, json.loads(data) if status == 200 else {}
+
+    def call(self, name, values, changed):
+        """Send one callback request, return its `response` or None.
+        Background callbacks are polled like the browser does, the latency
+        is until the result arrives."""
+        body = self.dashboard.body(name, values, changed)
+        path = "/_dash-update-component"
+        start = time.perf_counter()
+        status, data, payload = self._post(path, body)
+        size = len(data)
+        if "cacheKey" in payload:
+            query = urllib.parse.urlencode(
+                {"cacheKey": payload["cacheKey"], "job": payload["job"]}
+            )
+            interval = self.dashboard.callbacks[name]["long"]["interval"] / 1000
+            payload = {}
+            while status == 200 and "response" not in payload:
+                if time.perf_counter() - start > self.client.timeout:
+                    status = None  # job lost or stuck, counted as error
+                    break
+                time.sleep(interval)
+                status, data, payload = self._post(f"{path}?{query}", body)
+                size += len(data)
+        seconds = time.perf_counter() - start
+        self.stats.record(name, seconds, size, status in (200, 204))
+        if status != 200:
+            return None
+        return payload.get("response", {})
+
+    def _update(self, response):
+        if response is None:
+            return
+        plotted = response.get("store-graph-all", {}).get("data", self.plotted)
+        if isinstance(plotted, dict) and "__dash_patch_update" not in plotted:
+            self.plotted = plotted
+        self.pending = response.get("store-stream", {}).get("data", self.pending)
+
+    def click(self):
+        """Button click: create_graph, the stream ticks and analysis graphs."""
+        self.n_clicks += 1
+        response = self.call(
+            "create_graph",
+            {
+                "button-main.n_clicks": self.n_clicks,
+                "stat-picker.value": self.stations,
+                "parameter-picker.value": self.parameter,
+                "store-graph-all.data": self.plotted,
+            },
+            "button-main.n_clicks",
+        )
+        self._update(response)
+        self.analysis_graph()
+        for tick in range(1, MAX_STREAM_TICKS + 1):
+            if not self.pending:
+                break
+            response = self.call(
+                "stream_graph",
+                {
+                    "interval-stream.n_intervals": tick,
+                    "store-stream.data": self.pending,
+                    "store-graph-all.data": self.plotted,
+                },
+                "interval-stream.n_intervals",
+            )
+            self._update(response)
+            if response is None:
+                break
+            self.analysis_graph()
+
+    def analysis_graph(self):
+        """Graphs following store-graph-all: analysis and pairwise matrix."""
+        if self.plotted is None:
+            return
+        self.call(
+            "analysis_graph",
+            {
+                "store-graph-all.data": self.plotted,
+                "analysis-mode.value": self.analysis,
+                "analysis-window.value": 30,
+            },
+            "store-graph-all.data",
+        )
+        self.call(
+            "pairwise_graph",
+            {
+                "store-graph-all.data": self.plotted,
+                "pairwise-method.value": self.pairwise,
+                "pairwise-scope.value": "plotted",
+            },
+            "store-graph-all.data",
+        )
+
+    def lasso(self):
+        """Stations nearest to a random map point, like a lasso around it."""
+        dashboard = self.dashboard
+        center = self.rng.choice(dashboard.stations)
+        n = min(self.rng.choice(self.selected), len(dashboard.stations))
+        self.stations = sorted(
+            dashboard.stations,
+            key=lambda stat_id: (dashboard.lat[stat_id] - dashboard.lat[center]) ** 2
+            + (dashboard.lon[stat_id] - dashboard.lon[center]) ** 2,
+        )[:n]
+        self.click()
+
+    def dropdown(self):
+        if not self.stations:
+            return self.lasso()
+        others = [s for s in self.dashboard.stations if s not in self.stations]
+        n_max = max(max(self.selected), 2)
+        if others and len(self.stations) < n_max:
+            self.stations = [*self.stations, self.rng.choice(others)]
+        else:
+            removed = self.rng.choice(self.stations)
+            self.stations = [s for s in self.stations if s != removed]
+        self.click()
+
+    def parameter_change(self):
+        self.parameter = self.rng.choice(self.dashboard.parameters)
+        if not self.stations:
+            return self.lasso()
+        self.click()
+
+    def nearest(self):
+        stat_id = self.rng.choice(self.dashboard.stations)
+        point = {
+            "lat": self.dashboard.lat[stat_id],
+            "lon": self.dashboard.lon[stat_id],
+            "customdata": stat_id,
+        }
+        response = self.call(
+            "select_nearest",
+            {
+                "map-fig.clickData": {"points": [point]},
+                "map-mode.value": "nearest",
+                "nearest-n.value": self.rng.choice(self.selected),
+            },
+            "map-fig.clickData",
+        )
+        stations = (response or {}).get("stat-picker", {}).get("value")
+        if stations:
+            self.stations = stations
+            self.click()
+
+    def zoom(self):
+        if self.plotted is None:
+            return self.lasso()
+        start = datetime.date(self.rng.randint(*ZOOM_YEARS), 1, 1)
+        end = start + datetime.timedelta(days=self.rng.choice(ZOOM_DAYS))
+        self.call(
+            "zoom_graph",
+            {
+                "graph-all.relayoutData": {
+                    "xaxis.range[0]": start.isoformat(),
+                    "xaxis.range[1]": end.isoformat(),
+                },
+                "store-graph-all.data": self.plotted,
+            },
+            "graph-all.relayoutData",
+        )
+
+    def step(self):
+        """Run one random user action, return (action, seconds)."""
+        action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        run = {
+            "lasso": self.lasso,
+            "dropdown": self.dropdown,
+            "parameter": self.parameter_change,
+            "nearest": self.nearest,
+            "zoom": self.zoom,
+        }[action]
+        start = time.perf_counter()
+        run()
+        return action, time.perf_counter() - start
+
+
+class Stats:
+    """Latencies, sizes and errors recorded by every virtual user."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.recording = False
+        self.requests = {}
+        self.actions = {}
+        self.errors = 0
+        self.bytes = 0
+
+    def record(self, name, seconds, size, ok):
+        if not self.recording:
+            return
+        with self._lock:
+            self.requests.setdefault(name, []).append(seconds)
+            self.bytes += size
+            self.errors += not ok
+
+    def record_action(self, action, seconds):
+        if not self.recording:
+            return
+        with self._lock:
+            self.actions.setdefault(action, []).append(seconds)
+
+
+def percentiles(times):
+    """p50, p95 and p99 (seconds) of times."""
+    if len(times) < 2:
+        value = times[0] if times else None
+        return {"p50_s": value, "p95_s": value, "p99_s": value}
+    cuts = statistics.quantiles(times, n=100, method="inclusive")
+    return {"p50_s": cuts[49], "p95_s": cuts[94], "p99_s": cuts[98]}
+
+
+# WORKER MEMORY
+def worker_processes(pid):
+    """gunicorn workers (children) of master `pid`, or the process itself."""
+    if psutil is None or pid is None:
+        return []
+    try:
+        master = psutil.Process(pid)
+        return master.children() or [master]
+    except psutil.Error:
+        return []
+
+
+class MemorySampler(threading.Thread):
+    """Peak RSS (bytes) of every worker, sampled every `interval` seconds."""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = {}
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            for process in worker_processes(self.pid):
+                try:
+                    rss = process.memory_info().rss
+                except psutil.Error:
+                    continue
+                self.peak[process.pid] = max(self.peak.get(process.pid, 0), rss)
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return {pid: rss / 1024**2 for pid, rss in sorted(self.peak.items())}
+
+
+# RUN
+def run_level(url, dashboard, users, duration, warmup, think, selected, seed, pid):
+    """Run `users` sessions for warmup + duration seconds, return results of
+    the measured part."""
+    stats = Stats()
+    stop = threading.Event()
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(url)
+        session = Session(client, dashboard, stats, selected, rng)
+        try:
+            while not stop.is_set():
+                action, seconds = session.step()
+                stats.record_action(action, seconds)
+                if think:
+                    stop.wait(rng.expovariate(1 / think))
+        finally:
+            client.close()
+
+    threads = [
+        threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    sampler = MemorySampler(pid)
+    sampler.start()
+    stats.recording = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    stats.recording = False
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    n_requests = sum(len(times) for times in stats.requests.values())
+    return {
+        "users": users,
+        "duration_s": elapsed,
+        "requests": n_requests,
+        "throughput_rps": n_requests / elapsed,
+        "actions_per_s": sum(len(times) for times in stats.actions.values()) / elapsed,
+        "errors": stats.errors,
+        "response_mb_per_s": stats.bytes / 1024**2 / elapsed,
+        "callbacks": {
+            name: {"count": len(times), **percentiles(times)}
+            for name, times in sorted(stats.requests.items())
+        },
+        "actions": {
+            name: {"count": len(times), **percentiles(times)}
+            for name, times in sorted(stats.actions.items())
+        },
+        "worker_rss_mb": sampler.stop(),
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _apply_settings(path_config, settings):
+    """Set `SECTION.KEY=VALUE` overrides in config.ini at path_config."""
+    config = ConfigParser()
+    config.optionxform = str
+    config.read(path_config)
+    for setting in settings:
+        name, value = setting.split("=", 1)
+        section, key = name.rsplit(".", 1)
+        config[section][key] = value
+    with open(path_config, "w", encoding="utf-8") as file:
+        config.write(file)
+
+
+def _tail(path, n_lines=40):
+    lines = Path(path).read_text(errors="replace").splitlines()
+    return "\n".join(lines[-n_lines:])
+
+
+def start_server(folder, workers, threads, port):
+    """Start gunicorn in folder, return the process when it answers. Its log
+    goes to folder/gunicorn.log (a pipe nobody reads would block it)."""
+    path_log = Path(folder) / "gunicorn.log"
+    with open(path_log, "wb") as log:
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "app:server",
+                "--config",
+                str(ROOT / "gunicorn.conf.py"),
+                "--bind",
+                f"127.0.0.1:{port}",
+                "--workers",
+                str(workers),
+                "--threads",
+                str(threads),
+                "--timeout",
+                "300",
+            ],
+            cwd=folder,
+            env={**os.environ, "PYTHONPATH": str(ROOT)},
+            stdout=subprocess.DEVNULL,
+            stderr=log,
+        )
+    client = Client(f"http://127.0.0.1:{port}")
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited:\n{_tail(path_log)}")
+        try:
+            if client.request("GET", "/_dash-layout")[0] == 200:
+                return process
+        except OSError:
+            pass
+        finally:
+            client.close()
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not answer within 120 s:\n{_tail(path_log)}")
+
+
+def print_level(result):
+    rss = result["worker_rss_mb"]
+    memory = ", ".join(f"{mb:.0f}" for mb in rss.values()) if rss else "n/a"
+    print(
+        f"{result['users']} users: {result['throughput_rps']:.1f} req/s, "
+        f"{result['actions_per_s']:.2f} actions/s, {result['errors']} errors, "
+        f"worker RSS peak (MB): {memory}"
+    )
+    for group in ["callbacks", "actions"]:
+        for name, values in result[group].items():
+            if values["p50_s"] is None:
+                continue
+            print(
+                f"{name:>16}: n={values['count']:<5} "
+                f"p50 {values['p50_s'] * 1e3:8.1f} ms "
+                f"p95 {values['p95_s'] * 1e3:8.1f} ms "
+                f"p99 {values['p99_s'] * 1e3:8.1f} ms"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", help="running server, no synthetic database")
+    parser.add_argument("--pid", type=int, help="gunicorn master PID (with --url)")
+    parser.add_argument("--stations", type=int, default=100)
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="SECTION.KEY=VALUE",
+        help="config.ini override of the synthetic database, repeatable",
+    )
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds per level")
+    parser.add_argument(
+        "--think", type=float, default=1.0, help="mean seconds between actions"
+    )
+    parser.add_argument(
+        "--selected",
+        type=int,
+        nargs="+",
+        default=[1, 3, 5, 10, 30],
+        help="station counts of a selection",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="load-bmkg-") as folder:
+        process = None
+        url, pid = args.url, args.pid
+        if url is None:
+            synthetic.make_dataset(folder, args.stations, args.years, args.seed)
+            _apply_settings(Path(folder) / "config.ini", args.set)
+            port = _free_port()
+            process = start_server(folder, args.workers, args.threads, port)
+            url, pid = f"http://127.0.0.1:{port}", process.pid
+        if psutil is None:
+            print("psutil is not installed, worker memory is not measured")
+
+        try:
+            client = Client(url)
+            dashboard = Dashboard(client)
+            client.close()
+            levels = []
+            for users in args.users:
+                result = run_level(
+                    url,
+                    dashboard,
+                    users,
+                    args.duration,
+                    args.warmup,
+                    args.think,
+                    args.selected,
+                    args.seed,
+                    pid,
+                )
+                levels.append(result)
+                print_level(result)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    if args.output is not None:
+        from bench_pipeline import environment
+
+        setup = {
+            key: getattr(args, key)
+            for key in ["url", "stations", "years", "workers", "threads", "set"]
+        }
+        setup.update(think=args.think, selected=args.selected, seed=args.seed)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {"environment": environment(), "setup": setup, "levels": levels},
+                file,
+                indent=2,
+            )
+        print(f"written: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
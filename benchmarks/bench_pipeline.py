@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the data and figure pipeline on synthetic databases.
+
+For every station count a synthetic database is generated (see
+synthetic.py) and measured in a fresh process started in its folder. Stages:
+read (raw tables), clean, series (read + clean of one parameter),
+figure_parameter, figure_completeness, serialize (figures to JSON) and
+create_graph (the Dash callback end to end). Every stage reports median and
+best time, throughput and peak Python memory (tracemalloc, numpy and
+pandas buffers included).
+
+    python benchmarks/bench_pipeline.py --stations 10 50 --years 30 \\
+        --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import synthetic  # noqa: E402
+
+
+def measure(func, repeat, setup=None):
+    """Run func() `repeat` times, return (times, peak bytes). Peak memory is
+    taken from one more run, tracemalloc slows down the timed ones."""
+    setup = setup or (lambda: None)
+    times = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak
+
+
+def stage(times, peak, amount, unit):
+    median = statistics.median(times)
+    return {
+        "median_s": median,
+        "min_s": min(times),
+        "peak_mb": peak / 1024**2,
+        "throughput": amount / median if median else None,
+        "unit": f"{unit}/s",
+    }
+
+
+def run_child(repeat, n_selected, parameter):
+    """Measure every stage in the current folder (synthetic database)."""
+    import plotly.io as pio
+    import app
+    import pydata
+
+    metadata = pydata.read_metadata()
+    stations = metadata.index.tolist()
+    selected = stations[:n_selected]
+    clear_cache = pydata.station_cache.clear
+
+    tables = {}
+
+    def read():
+        for stat_id in stations:
+            tables[stat_id] = pydata.read_station_table(
+                pydata.FILE_BMKG, stat_id, clean=False
+            )
+
+    read()
+    n_rows = sum(len(table) for table in tables.values())
+    n_values = sum(table.size for table in tables.values())
+
+    results = {}
+    results["read"] = stage(*measure(read, repeat, clear_cache), n_rows, "rows")
+
+    def clean():
+        for table in tables.values():
+            pydata.clean_table(table.copy())
+
+    results["clean"] = stage(*measure(clean, repeat), n_values, "values")
+
+    def series():
+        pydata.read_stations_series(stations, parameter)
+
+    results["series"] = stage(
+        *measure(series, repeat, clear_cache), len(stations), "stations"
+    )
+
+    # figures from a warm station cache, without the figure cache
+    pydata.read_stations_series(selected, parameter)
+    figures = {}
+
+    def figure_parameter():
+        figures["parameter"] = app.figure_with_parameter.__wrapped__(
+            selected, parameter
+        )
+
+    def figure_completeness():
+        figures["completeness"] = app.figure_completeness.__wrapped__(
+            selected, parameter
+        )
+
+    results["figure_parameter"] = stage(
+        *measure(figure_parameter, repeat), len(selected), "stations"
+    )
+    results["figure_completeness"] = stage(
+        *measure(figure_completeness, repeat), len(selected), "stations"
+    )
+
+    payload = {}
+
+    def serialize():
+        payload["json"] = [
+            pio.to_json(figure, validate=False) for figure in figures.values()
+        ]
+
+    serialize()
+    n_bytes = sum(len(text) for text in payload["json"])
+    results["serialize"] = stage(*measure(serialize, repeat), n_bytes / 1024**2, "MB")
+
+    client = app.server.test_client()
+    body = {
+        "output": (
+            "..graph-all.figure...graph-completeness.figure...store-graph-all.data"
+            "...store-stream.data...interval-stream.disabled.."
+        ),
+        "outputs": [
+            {"id": "graph-all", "property": "figure"},
+            {"id": "graph-completeness", "property": "figure"},
+            {"id": "store-graph-all", "property": "data"},
+            {"id": "store-stream", "property": "data"},
+            {"id": "interval-stream", "property": "disabled"},
+        ],
+        "inputs": [{"id": "button-main", "property": "n_clicks", "value": 1}],
+        "state": [
+            {"id": "stat-picker", "property": "value", "value": selected},
+            {"id": "parameter-picker", "property": "value", "value": parameter},
+            {"id": "store-graph-all", "property": "data", "value": None},
+        ],
+        "changedPropIds": ["button-main.n_clicks"],
+    }
+
+    def create_graph():
+        response = client.post("/_dash-update-component", json=body)
+        assert response.status_code == 200, response.status_code
+        payload["response"] = len(response.data)
+
+    def clear_all():
+        clear_cache()
+        if app.figure_cache.backend is not None:
+            app.figure_cache.backend.clear()
+
+    results["create_graph"] = stage(
+        *measure(create_graph, repeat, clear_all), len(selected), "stations"
+    )
+    results["create_graph"]["response_mb"] = payload["response"] / 1024**2
+
+    print(json.dumps(results))
+
+
+def run(n_stations, years, repeat, n_selected, parameter, seed):
+    with tempfile.TemporaryDirectory(prefix="bench-bmkg-") as folder:
+        start = time.perf_counter()
+        synthetic.make_dataset(folder, n_stations, years, seed)
+        generate = time.perf_counter() - start
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--child",
+                "--repeat",
+                str(repeat),
+                "--selected",
+                str(n_selected),
+                "--parameter",
+                parameter,
+            ],
+            cwd=folder,
+            check=True,
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PYTHONPATH": str(ROOT)},
+        ).stdout
+        file_size = (Path(folder) / synthetic.FILE_NAME_BMKG).stat().st_size
+    return {
+        "stations": n_stations,
+        "years": years,
+        "selected": n_selected,
+        "parameter": parameter,
+        "generate_s": generate,
+        "file_mb": file_size / 1024**2,
+        "stages": json.loads(output.strip().splitlines()[-1]),
+    }
+
+
+def environment():
+    import dash
+    import numpy
+    import pandas
+    import plotly
+
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    return {
+        "commit": commit or None,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "plotly": plotly.__version__,
+        "dash": dash.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stations", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--selected", type=int, default=5, help="stations plotted per figure"
+    )
+    parser.add_argument("--parameter", default="RR")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.repeat, args.selected, args.parameter)
+        return
+
+    runs = []
+    for n_stations in args.stations:
+        result = run(
+            n_stations,
+            args.years,
+            args.repeat,
+            min(args.selected, n_stations),
+            args.parameter,
+            args.seed,
+        )
+        runs.append(result)
+        print(
+            f"{n_stations} stations x {args.years} years "
+            f"({result['file_mb']:.1f} MB), median of {args.repeat}:"
+        )
+        for name, values in result["stages"].items():
+            print(
+                f"{name:>20}: {values['median_s'] * 1e3:9.1f} ms "
+                f"{values['throughput']:12.1f} {values['unit']:<11} "
+                f"peak {values['peak_mb']:8.1f} MB"
+            )
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"environment": environment(), "runs": runs}, file, indent=2)
+        print(f"written: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
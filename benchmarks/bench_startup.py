@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Startup benchmark: import time of `app` and first-response latency of a
+fresh process (`/` and `/_dash-layout`), like a new gunicorn worker.
+
+Run from the folder holding config.ini: `python benchmarks/bench_startup.py`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.server.test_client()
+client.get("/")
+t2 = time.perf_counter()
+response = client.get("/_dash-layout")
+t3 = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import": t1 - t0, "index": t2 - t1, "layout": t3 - t2}))
+"""
+
+
+def run_once():
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        check=True,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": str(ROOT)},
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = [run_once() for _ in range(args.runs)]
+    print(f"runs: {args.runs} (median, ms)")
+    for stage in ["import", "index", "layout"]:
+        median = statistics.median(result[stage] for result in results)
+        print(f"{stage:>8}: {median * 1e3:8.1f}")
+    first_response = statistics.median(
+        sum(result.values()) for result in results
+    )
+    print(f"{'total':>8}: {first_response * 1e3:8.1f} (process start to layout)")
+
+
+if __name__ == "__main__":
+    main()
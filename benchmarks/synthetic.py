@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Synthetic BMKG-shaped database for benchmarks.
+
+Writes `dummy_data.h5` (`/metadata/files` and `/stations/sta{id}` with the
+ten daily parameters and 8888/9999 sentinels), the matching
+`dummy_completeness.h5` and a `config.ini` pointing to them, so the app can
+be started from the output folder:
+
+    python benchmarks/synthetic.py /tmp/bmkg --stations 200 --years 30
+"""
+
+import argparse
+import configparser
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+PARAMETERS = "Tn Tx Tavg RH_avg RR ss ff_x ddd_x ff_avg ddd_car".split()
+DIRECTIONS = np.array(["C", "N", "NE", "E", "SE", "S", "SW", "W", "NW"])
+FILE_NAME_BMKG = "dummy_data.h5"
+FILE_NAME_BMKG_COMPLETENESS = "dummy_completeness.h5"
+
+
+def make_metadata(n_stations, rng):
+    """Stations spread over Indonesia, IDs in the WMO 96xxx/97xxx range."""
+    ids = np.sort(rng.choice(np.arange(96001, 97999), n_stations, replace=False))
+    return pd.DataFrame(
+        {
+            "Nama Stasiun": [f"Stasiun Meteorologi {stat_id}" for stat_id in ids],
+            "Lintang": rng.uniform(-11, 6, n_stations).round(5),
+            "Bujur": rng.uniform(95, 141, n_stations).round(5),
+        },
+        index=pd.Index(ids, name="ID"),
+    )
+
+
+def make_station(dates, rng, ratio_missing=0.05, ratio_sentinel=0.03):
+    """Daily table of one station with sentinels and missing values."""
+    n = dates.size
+    season = np.sin(2 * np.pi * dates.dayofyear.to_numpy() / 365.25)
+    tavg = 27 + 0.8 * season + rng.normal(0, 0.8, n)
+    is_wet = rng.random(n) < 0.4 + 0.2 * season
+    table = pd.DataFrame(
+        {
+            "Tn": tavg - rng.uniform(3, 6, n),
+            "Tx": tavg + rng.uniform(3, 7, n),
+            "Tavg": tavg,
+            "RH_avg": rng.uniform(60, 98, n),
+            "RR": np.where(is_wet, rng.gamma(0.8, 15, n), 0),
+            "ss": rng.uniform(0, 12, n),
+            "ff_x": rng.uniform(0, 15, n).round(0),
+            "ddd_x": rng.integers(0, 36, n) * 10.0,
+            "ff_avg": rng.uniform(0, 6, n).round(0),
+        },
+        index=dates,
+    ).round(1)
+
+    values = table.to_numpy()
+    is_sentinel = rng.random(values.shape) < ratio_sentinel
+    values[is_sentinel] = rng.choice([8888.0, 9999.0], is_sentinel.sum())
+    values[rng.random(values.shape) < ratio_missing] = np.nan
+    table = pd.DataFrame(values, index=dates, columns=table.columns)
+    table["ddd_car"] = DIRECTIONS[rng.integers(0, DIRECTIONS.size, n)]
+    return table[PARAMETERS]
+
+
+def completeness(table):
+    """Monthly fraction of valid (not missing, not sentinel) days."""
+    is_valid = table.notna() & ~table.isin([8888, 9999])
+    return is_valid.resample("MS").mean()
+
+
+def write_config(folder):
+    """config.ini of the repository with database paths of `folder`."""
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(ROOT / "config.ini")
+    config["PATH BMKG DATABASE"]["FOLDER_BMKG"] = "."
+    config["PATH BMKG DATABASE"]["FILE_NAME_BMKG"] = FILE_NAME_BMKG
+    config["PATH BMKG DATABASE"][
+        "FILE_NAME_BMKG_COMPLETENESS"
+    ] = FILE_NAME_BMKG_COMPLETENESS
+    with open(folder / "config.ini", "w", encoding="utf-8") as file:
+        config.write(file)
+
+
+def make_dataset(folder, n_stations=50, years=30, seed=0):
+    """Write synthetic database of n_stations x years (daily) in folder."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    metadata = make_metadata(n_stations, rng)
+    end = pd.Timestamp("2023-12-31")
+    dates = pd.date_range(end - pd.DateOffset(years=years) + pd.Timedelta(days=1), end)
+
+    with pd.HDFStore(folder / FILE_NAME_BMKG, mode="w") as store, pd.HDFStore(
+        folder / FILE_NAME_BMKG_COMPLETENESS, mode="w"
+    ) as store_completeness:
+        store.put("/metadata/files", metadata)
+        for stat_id in metadata.index:
+            # stations start at different dates, like the real network
+            table = make_station(dates[rng.integers(0, dates.size // 2) :], rng)
+            store.put(f"/stations/sta{stat_id}", table)
+            store_completeness.put(
+                f"/stations/sta{stat_id}", completeness(table), format="table"
+            )
+    write_config(folder)
+    return metadata
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--stations", type=int, default=50)
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    make_dataset(args.folder, args.stations, args.years, args.seed)
+    print(f"written: {args.folder} ({args.stations} stations, {args.years} years)")
+
+
+if __name__ == "__main__":
+    main()
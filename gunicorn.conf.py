@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""gunicorn settings, read automatically when started from this folder
+(`gunicorn app:server`, see Procfile)."""
+
+
+def on_starting(server):
+    """With BACKEND = cube, materialize the station cube once in the master
+    process, before workers are forked. Workers only attach to it read-only."""
+    import pydata
+
+    if pydata.STORAGE_BACKEND != "cube":
+        return
+
+    path_cube = pydata.FILE_CUBE
+    if (
+        path_cube.exists()
+        and path_cube.stat().st_mtime_ns >= pydata.FILE_BMKG.stat().st_mtime_ns
+    ):
+        return
+
+    import pybuild
+
+    server.log.info("building station cube: %s", path_cube)
+    pybuild.build_station_cube(pydata.FILE_BMKG, path_cube)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import warnings
+import numpy as np
+import pandas as pd
+import pydata
+import pymetrics
+from pycache import LRUCache
+
+# PARSE CONFIG
+CONFIG_PATH = "config.ini"
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+ROLLING_WINDOW = int(config["ANALYTICS"]["ROLLING_WINDOW"])
+MAX_WINDOW = int(config["ANALYTICS"]["MAX_WINDOW"])
+MIN_FRACTION = float(config["ANALYTICS"]["MIN_FRACTION"])
+ANALYTICS_CACHE_MB = float(config["ANALYTICS"]["CACHE_MB"])
+PAIR_MIN_DAYS = int(config["ANALYTICS"]["PAIR_MIN_DAYS"])
+PAIR_BLOCK = int(config["ANALYTICS"]["PAIR_BLOCK"])
+
+ANALYSES = ["rolling", "climatology", "anomaly"]
+PAIRWISE = ["pearson", "rmsd"]
+
+
+# KERNELS: ROWS ARE STATIONS, COLUMNS ARE DAYS
+def stack_series(stations_series, stations):
+    """Return (values, dates): float64 array station x date of daily series
+    on the union of their dates, NaN where a station has no value."""
+    indexes = [stations_series[stat_id].index for stat_id in stations]
+    indexes = [index for index in indexes if index.size]
+    if not indexes:
+        return np.empty((len(stations), 0)), pd.DatetimeIndex([])
+    start = min(index[0] for index in indexes).normalize()
+    end = max(index[-1] for index in indexes).normalize()
+    dates = pd.date_range(start, end, freq="D")
+
+    values = np.full((len(stations), dates.size), np.nan)
+    for i, stat_id in enumerate(stations):
+        series = stations_series[stat_id]
+        days = (series.index.normalize() - start).days.to_numpy()
+        values[i, days] = series.to_numpy(dtype=float)
+    return values, dates
+
+
+def rolling_mean(values, window, min_periods=1):
+    """Trailing mean over `window` columns of every row, ignoring NaN; NaN
+    where the window holds fewer than `min_periods` values."""
+    is_valid = ~np.isnan(values)
+    n_row, n_col = values.shape
+    total = np.zeros((n_row, n_col + 1))
+    count = np.zeros((n_row, n_col + 1))
+    np.cumsum(np.where(is_valid, values, 0), axis=1, out=total[:, 1:])
+    np.cumsum(is_valid, axis=1, out=count[:, 1:])
+
+    lag = np.maximum(np.arange(1, n_col + 1) - window, 0)
+    total = total[:, 1:] - total[:, lag]
+    count = count[:, 1:] - count[:, lag]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    mean[count < max(min_periods, 1)] = np.nan
+    return mean
+
+
+def climatology(values, dates):
+    """Mean of every calendar month (12 columns) of every row, ignoring NaN."""
+    is_valid = ~np.isnan(values)
+    # ONE-HOT MONTH MATRIX, SUMS OF ALL STATIONS IN ONE MATRIX PRODUCT
+    months = np.eye(12)[dates.month.to_numpy() - 1]
+    total = np.where(is_valid, values, 0) @ months
+    count = is_valid @ months
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def anomaly(values, dates, values_climatology=None):
+    """Departure of every value from the climatology of its month."""
+    if values_climatology is None:
+        values_climatology = climatology(values, dates)
+    return values - values_climatology[:, dates.month.to_numpy() - 1]
+
+
+def analyze(values, dates, analysis, window):
+    """Return (result, index) of `analysis` (see ANALYSES) for stacked values.
+    Anomalies are smoothed with the same rolling window."""
+    min_periods = int(np.ceil(window * MIN_FRACTION))
+    if analysis == "rolling":
+        return rolling_mean(values, window, min_periods), dates
+    if analysis == "climatology":
+        return climatology(values, dates), pd.RangeIndex(1, 13, name="month")
+    if analysis == "anomaly":
+        return rolling_mean(anomaly(values, dates), window, min_periods), dates
+    raise ValueError(f"unknown analysis: {analysis}")
+
+
+def pairwise_matrix(values, method="pearson", min_periods=1, block=PAIR_BLOCK):
+    """Row x row matrix of Pearson correlation or RMSD (root mean squared
+    difference) over pairwise-complete columns, the days both rows have a
+    value; NaN where fewer than `min_periods` such days.
+
+    Every sum over common days is a matrix product with the 0/1 valid mask,
+    computed for one block x block tile of rows at a time, so memory is the
+    matrix plus a few tiles, whatever the number of rows.
+    """
+    if method not in PAIRWISE:
+        raise ValueError(f"unknown method: {method}")
+    is_valid = ~np.isnan(values)
+    mask = is_valid.astype(float)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # rows without values
+        if method == "pearson":
+            # correlation is shift invariant: centered rows keep the sums small
+            center = np.nanmean(values, axis=1, keepdims=True)
+        else:
+            # differences are not, one shift for every row
+            center = np.nanmean(values)
+    x = np.where(is_valid, values - center, 0)
+    x2 = x * x
+
+    n_row = len(values)
+    matrix = np.full((n_row, n_row), np.nan)
+    for i in range(0, n_row, block):
+        rows = slice(i, i + block)
+        for j in range(i, n_row, block):
+            cols = slice(j, j + block)
+            count = mask[rows] @ mask[cols].T
+            sum_xy = x[rows] @ x[cols].T
+            sum_xx = x2[rows] @ mask[cols].T
+            sum_yy = mask[rows] @ x2[cols].T
+            with np.errstate(invalid="ignore", divide="ignore"):
+                if method == "pearson":
+                    sum_x = x[rows] @ mask[cols].T
+                    sum_y = mask[rows] @ x[cols].T
+                    cov = sum_xy - sum_x * sum_y / count
+                    var_x = sum_xx - sum_x**2 / count
+                    var_y = sum_yy - sum_y**2 / count
+                    tile = np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+                else:
+                    squares = np.maximum(sum_xx + sum_yy - 2 * sum_xy, 0)
+                    tile = np.sqrt(squares / count)
+            tile[count < max(min_periods, 1)] = np.nan
+            matrix[rows, cols] = tile
+            matrix[cols, rows] = tile.T
+    return matrix
+
+
+# RESULTS PER STATION (PER PROCESS)
+def _nbytes(result):
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True).sum())
+    return result.nbytes + result.index.nbytes
+
+
+analytics_cache = LRUCache(int(ANALYTICS_CACHE_MB * 1024**2), _nbytes)
+
+
+def stations_analysis(stations, parameter, analysis, window=ROLLING_WINDOW):
+    """Return {stat_id: series} of `analysis` of daily parameter, cached by
+    (station, parameter, analysis, window, data version). Stations not cached
+    are read and computed together in one pass."""
+    window = None if analysis == "climatology" else int(window)
+    version = pydata.data_version([])  # files, stations are keyed below
+
+    def key(stat_id):
+        return (
+            stat_id,
+            parameter,
+            analysis,
+            window,
+            version,
+            pydata.station_version(stat_id),
+        )
+
+    results = {stat_id: analytics_cache.get(key(stat_id)) for stat_id in stations}
+    missing = [stat_id for stat_id, series in results.items() if series is None]
+    if missing:
+        stations_series = pydata.read_stations_series(missing, parameter)
+        with pymetrics.span("analytics"):
+            values, dates = stack_series(stations_series, missing)
+            values, index = analyze(values, dates, analysis, window or 1)
+        for stat_id, row in zip(missing, values):
+            series = pd.Series(row, index=index, name=parameter)
+            if analysis != "climatology":
+                series = _trim(series)
+            series = series.copy()  # a row view would keep the whole array alive
+            analytics_cache.put(key(stat_id), series)
+            results[stat_id] = series
+    return results
+
+
+def _trim(series):
+    """Drop leading/trailing NaN (other stations widen the stacked dates)."""
+    is_valid = np.flatnonzero(~np.isnan(series.to_numpy()))
+    if not is_valid.size:
+        return series.iloc[:0]
+    return series.iloc[is_valid[0] : is_valid[-1] + 1]
+
+
+def stations_pairwise(stations, parameter, method, min_days=PAIR_MIN_DAYS):
+    """Return station x station DataFrame of `method` (see PAIRWISE) of daily
+    parameter. A pair only depends on its two stations, so the matrix of the
+    whole network is cached and any selection is taken from it."""
+    key = ("pairwise", parameter, method, min_days, pydata.data_version())
+    network = analytics_cache.get(key)
+    if network is not None and set(stations) <= set(network.index):
+        return network.loc[stations, stations]
+
+    stations_series = pydata.read_stations_series(stations, parameter)
+    with pymetrics.span("pairwise"):
+        values, _ = stack_series(stations_series, stations)
+        matrix = pairwise_matrix(values, method, min_days)
+    matrix = pd.DataFrame(
+        matrix.astype(np.float32), index=stations, columns=stations
+    )
+    if set(pydata.read_metadata().index) <= set(stations):
+        analytics_cache.put(key, matrix)
+    return matrix
+
+
+def cache_info():
+    """Hit/miss counters of analytics cache."""
+    return analytics_cache.info()
@@ -0,0 +1,794 @@
+# -*- coding: utf-8 -*-
+"""Offline build steps for the BMKG database. See `python pybuild.py -h`."""
+
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from pydata import (
+    AGGREGATE_LEVELS,
+    AGGREGATE_SUM_MIN_FRACTION,
+    DATASET_BMKG,
+    DATASET_COMPLETENESS,
+    FILE_AGGREGATE,
+    FILE_BMKG,
+    FILE_COMPLETENESS,
+    FILE_COMPLETENESS_MATRIX,
+    FILE_CUBE,
+    FILE_MANIFEST,
+    FILE_METADATA,
+    FOLDER_PARQUET,
+    SCHEMA_MAX_ERROR,
+    aggregate_method,
+    check_roundtrip,
+    clean_table,
+    compact_table,
+    decode_table,
+    encode_int16,
+    encode_table,
+    get_table,
+    read_manifest,
+    read_metadata,
+    read_station_table,
+    roundtrip_error,
+    schema,
+    store_lock,
+)
+
+# ~10 YEARS OF DAILY ROWS, LETS DATE FILTERS SKIP ROW GROUPS
+ROW_GROUP_SIZE = 3653
+
+
+def _replace_atomic(path_tmp, path):
+    os.replace(path_tmp, path)
+    print(f"written: {path}")
+
+
+def _keys(store):
+    """Keys of store without the categories nodes of categorical columns."""
+    return [key for key in store.keys() if "/meta/" not in key]
+
+
+# BUILD: TABLE FORMAT
+def convert_to_table(path, clean=False, compact=False, complevel=5, complib="blosc"):
+    """Rewrite every node of HDF5 store as queryable `table` format.
+
+    Table format allows `store.select(columns=..., where=...)`, so only the
+    requested parameter and date range are read from disk. `clean` and
+    `compact` are for the observation store only (not completeness): with
+    `clean`, sentinels of station tables are replaced once here and the node
+    is marked so the read path skips masking. `compact` (implies `clean`)
+    stores station tables in the [SCHEMA] dtypes (see pydata.encode_table),
+    checked against the cleaned values before writing.
+    """
+    clean = clean or compact
+    path = Path(path)
+    path_tmp = path.with_suffix(".tmp.h5")
+    try:
+        with pd.HDFStore(path, mode="r") as src, pd.HDFStore(
+            path_tmp, mode="w", complevel=complevel, complib=complib
+        ) as dst:
+            for key in _keys(src):
+                table = get_table(src, key)
+                if isinstance(table.index, pd.DatetimeIndex):
+                    # where= terms are compared in ns
+                    table.index = table.index.as_unit("ns")
+                is_station = key.startswith("/stations/sta")
+                if clean and is_station:
+                    clean_table(table)
+                scales = {}
+                if compact and is_station:
+                    encoded, scales = encode_table(table)
+                    check_roundtrip(table, decode_table(encoded.copy(), scales), key)
+                    table = encoded
+                dst.put(key, table, format="table")
+                if clean and is_station:
+                    dst.get_storer(key).attrs.cleaned = True
+                if scales:
+                    dst.get_storer(key).attrs.scales = scales
+        _replace_atomic(path_tmp, path)
+    finally:
+        path_tmp.unlink(missing_ok=True)
+
+
+# BUILD: COMPLETENESS MATRIX
+def build_completeness_matrix(path, path_matrix):
+    """Pack completeness of every station into one parameter x station x month
+    float32 array (percent, NaN where missing) with a JSON index sidecar."""
+    path_matrix = Path(path_matrix)
+    tables = {}
+    with pd.HDFStore(path, mode="r") as store:
+        for key in _keys(store):
+            if key.startswith("/stations/sta"):
+                tables[int(key.removeprefix("/stations/sta"))] = store.get(key)
+
+    stations = sorted(tables)
+    parameters = list(tables[stations[0]].columns)
+    months = pd.DatetimeIndex(
+        sorted(set().union(*(table.index for table in tables.values())))
+    )
+
+    values = np.full((len(parameters), len(stations), len(months)), np.nan)
+    for i, stat_id in enumerate(stations):
+        table = tables[stat_id].reindex(index=months, columns=parameters)
+        values[:, i, :] = table.to_numpy().T
+    values = (values.round(3) * 100).astype(np.float32)
+
+    index = {
+        "stations": stations,
+        "months": months.strftime("%Y-%m-%d").tolist(),
+        "parameters": parameters,
+    }
+    path_tmp = path_matrix.with_suffix(".tmp.npy")
+    np.save(path_tmp, values)
+    with open(path_matrix.with_suffix(".json"), "w", encoding="utf-8") as file:
+        json.dump(index, file)
+    _replace_atomic(path_tmp, path_matrix)
+
+
+# BUILD: PARQUET DATASET
+def write_parquet_dataset(path, path_dataset, clean=False):
+    """Write station tables of HDF5 store as Parquet dataset partitioned by
+    station (`station=<id>/part-0.parquet`) with a `date` column."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path_dataset = Path(path_dataset)
+    path_tmp = path_dataset.with_name(path_dataset.name + ".tmp")
+    shutil.rmtree(path_tmp, ignore_errors=True)
+
+    with pd.HDFStore(path, mode="r") as store:
+        for key in _keys(store):
+            if not key.startswith("/stations/sta"):
+                continue
+            stat_id = int(key.removeprefix("/stations/sta"))
+            table = get_table(store, key)
+            if clean:
+                clean_table(table)
+                compact = compact_table(table)
+                check_roundtrip(table, compact, key)
+                table = compact
+            table = table.sort_index().rename_axis("date").reset_index()
+            table["date"] = table["date"].astype("datetime64[ns]")
+            path_part = path_tmp / f"station={stat_id}"
+            path_part.mkdir(parents=True)
+            pq.write_table(
+                pa.Table.from_pandas(table, preserve_index=False),
+                path_part / "part-0.parquet",
+                row_group_size=ROW_GROUP_SIZE,
+                compression="zstd",
+            )
+
+    shutil.rmtree(path_dataset, ignore_errors=True)
+    os.replace(path_tmp, path_dataset)
+    print(f"written: {path_dataset}")
+
+
+def build_parquet(path, path_completeness, folder):
+    """Convert both HDF5 stores (cleaned) and station metadata to Parquet."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    with pd.HDFStore(path, mode="r") as store:
+        metadata = store.get("/metadata/files")
+    path_metadata = folder / "metadata.parquet"
+    metadata.to_parquet(folder / "metadata.tmp.parquet")
+    _replace_atomic(folder / "metadata.tmp.parquet", path_metadata)
+    write_parquet_dataset(path, folder / "stations", clean=True)
+    write_parquet_dataset(path_completeness, folder / "completeness")
+
+
+# BUILD: STATION CUBE
+def _read_index(store, key):
+    if store.get_storer(key).is_table:
+        return pd.DatetimeIndex(store.select_column(key, "index"))
+    return store.get(key).index
+
+
+def _station_keys(store):
+    """Sorted [(stat_id, key)] of station tables."""
+    return sorted(
+        (int(key.removeprefix("/stations/sta")), key)
+        for key in _keys(store)
+        if key.startswith("/stations/sta")
+    )
+
+
+def _daily_dates(store, keys):
+    """Daily dates covering every station table."""
+    starts, ends = [], []
+    for _, key in keys:
+        index = _read_index(store, key)
+        starts.append(index.min())
+        ends.append(index.max())
+    return pd.date_range(min(starts).normalize(), max(ends), freq="D")
+
+
+def _span(table):
+    """[first, last + 1) rows of table holding any value."""
+    is_valid = np.flatnonzero(table.notna().any(axis=1).to_numpy())
+    return [int(is_valid[0]), int(is_valid[-1]) + 1] if is_valid.size else [0, 0]
+
+
+def _write_index(path_cube, index):
+    with open(path_cube.with_suffix(".json"), "w", encoding="utf-8") as file:
+        json.dump(index, file)
+
+
+def build_station_cube(path, path_cube):
+    """Write cleaned station tables into one float32 array (parameter x
+    station x date, daily) with a JSON index sidecar. Stations are written one
+    at a time, so memory stays at a single table."""
+    path_cube = Path(path_cube)
+    version = read_manifest()["version"]
+    with pd.HDFStore(path, mode="r") as store:
+        keys = _station_keys(store)
+        dates = _daily_dates(store, keys)
+        stations = [stat_id for stat_id, _ in keys]
+
+        path_tmp = path_cube.with_suffix(".tmp.npy")
+        values, parameters = None, None
+        spans = []
+        for i, (_, key) in enumerate(keys):
+            table = get_table(store, key)
+            clean_table(table)
+            if values is None:
+                parameters = list(table.select_dtypes("number").columns)
+                values = np.lib.format.open_memmap(
+                    path_tmp,
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(len(parameters), len(stations), len(dates)),
+                )
+            table = table.reindex(index=dates, columns=parameters)
+            values[:, i, :] = table.to_numpy(dtype=np.float32).T
+            spans.append(_span(table))
+        values.flush()
+        del values
+
+    _write_index(
+        path_cube,
+        {
+            "stations": stations,
+            "parameters": parameters,
+            "start": dates[0].strftime("%Y-%m-%d"),
+            "spans": spans,
+            "version": version,
+        },
+    )
+    _replace_atomic(path_tmp, path_cube)
+
+
+# BUILD: AGGREGATES
+AGGREGATE_METHODS = ["mean", "min", "max", "sum", "circular"]
+
+
+def aggregate_table(
+    table, freq, methods, sum_min_fraction=AGGREGATE_SUM_MIN_FRACTION
+):
+    """Resample table to `freq` with {parameter: method}. Periods without any
+    value are NaN, sums also if less than `sum_min_fraction` of the days of
+    the period have a value. circular is the mean direction of degrees."""
+    resampler = table.resample(freq)
+    columns = []
+    for method in dict.fromkeys(methods.values()):
+        if method not in AGGREGATE_METHODS:
+            raise ValueError(f"unknown aggregate method: {method}")
+        parameters = [par for par, by in methods.items() if by == method]
+        if method == "circular":
+            radians = np.deg2rad(table[parameters])
+            sin = np.sin(radians).resample(freq).mean()
+            cos = np.cos(radians).resample(freq).mean()
+            degrees = np.rad2deg(np.arctan2(sin, cos)) % 360
+            columns.append(degrees.mask(degrees == 360, 0))  # -tiny % 360
+            continue
+        kwargs = {} if method == "mean" else {"min_count": 1}
+        column = getattr(resampler[parameters], method)(**kwargs)
+        if method == "sum":
+            periods = column.index
+            days = (periods + pd.tseries.frequencies.to_offset(freq) - periods).days
+            valid = resampler[parameters].count().div(days.to_numpy(), axis=0)
+            column = column.where(valid >= sum_min_fraction)
+        columns.append(column)
+    return pd.concat(columns, axis=1)[list(methods)]
+
+
+def build_aggregates(path, paths_aggregate):
+    """Write cleaned station tables resampled to every level of
+    AGGREGATE_LEVELS (methods from `[AGGREGATE]`), one cube per level in the
+    layout of build_station_cube. Each station is read once for all levels."""
+    paths_aggregate = {level: Path(path) for level, path in paths_aggregate.items()}
+    version = read_manifest()["version"]
+    with pd.HDFStore(path, mode="r") as store:
+        keys = _station_keys(store)
+        dates = pd.Series(0, index=_daily_dates(store, keys))
+        periods = {
+            level: dates.resample(freq).size().index
+            for level, freq in AGGREGATE_LEVELS.items()
+        }
+        stations = [stat_id for stat_id, _ in keys]
+
+        values, methods = {}, None
+        spans = {level: [] for level in AGGREGATE_LEVELS}
+        for i, (_, key) in enumerate(keys):
+            table = get_table(store, key)
+            clean_table(table)
+            if methods is None:
+                methods = {
+                    parameter: aggregate_method(parameter)
+                    for parameter in table.select_dtypes("number").columns
+                }
+                values = {
+                    level: np.lib.format.open_memmap(
+                        path_aggregate.with_suffix(".tmp.npy"),
+                        mode="w+",
+                        dtype=np.float32,
+                        shape=(len(methods), len(stations), len(periods[level])),
+                    )
+                    for level, path_aggregate in paths_aggregate.items()
+                }
+            table = table[list(methods)]
+            for level, freq in AGGREGATE_LEVELS.items():
+                aggregated = aggregate_table(table, freq, methods).reindex(
+                    periods[level]
+                )
+                values[level][:, i, :] = aggregated.to_numpy(dtype=np.float32).T
+                spans[level].append(_span(aggregated))
+
+    for level, path_aggregate in paths_aggregate.items():
+        values[level].flush()
+        _write_index(
+            path_aggregate,
+            {
+                "stations": stations,
+                "parameters": list(methods),
+                "methods": methods,
+                "start": periods[level][0].strftime("%Y-%m-%d"),
+                "freq": AGGREGATE_LEVELS[level],
+                "spans": spans[level],
+                "version": version,
+            },
+        )
+        _replace_atomic(path_aggregate.with_suffix(".tmp.npy"), path_aggregate)
+    del values
+
+
+# UPDATE: APPEND NEW DAILY ROWS
+def read_new_rows(path_new):
+    """{stat_id: table} of new daily rows: CSV or Parquet in the layout of the
+    export route (station, date, parameters...) or HDF5 with
+    /stations/sta<id> tables."""
+    path_new = Path(path_new)
+    if path_new.suffix in [".h5", ".hdf5"]:
+        with pd.HDFStore(path_new, mode="r") as store:
+            return {
+                stat_id: get_table(store, key) for stat_id, key in _station_keys(store)
+            }
+    if path_new.suffix == ".parquet":
+        table = pd.read_parquet(path_new)
+    else:
+        table = pd.read_csv(path_new, parse_dates=["date"])
+    return {
+        int(stat_id): group.drop(columns="station")
+        .set_index("date")
+        .rename_axis(None)
+        .sort_index()
+        for stat_id, group in table.groupby("station")
+    }
+
+
+def _encode_rows(store, key, rows):
+    """Rows dated after the last row of node `key`, encoded in the format of
+    the node (sentinels cleaned, int16 scales, categories). Raise ValueError
+    if they do not fit; nothing is written."""
+    storer = store.get_storer(key)
+    scales = getattr(storer.attrs, "scales", None) or {}
+    if storer.is_table:
+        head = store.select(key, start=0, stop=1)
+        last = store.select(key, start=max(storer.nrows - 1, 0)).index
+    else:
+        head = store.get(key)
+        last = head.index[-1:]
+    if len(last):
+        rows = rows[rows.index > last[-1]]
+    if rows.empty:
+        return rows
+
+    rows = rows.reindex(columns=head.columns)
+    rows.index = pd.DatetimeIndex(rows.index).as_unit("ns")
+    if getattr(storer.attrs, "cleaned", False):
+        clean_table(rows)
+    for column in head.columns:
+        if column in scales:
+            rows[column] = encode_int16(rows[column], scales[column], column)
+        elif isinstance(head[column].dtype, pd.CategoricalDtype):
+            categories = head[column].cat.categories
+            unknown = set(rows[column].dropna()) - set(categories)
+            if unknown:
+                raise ValueError(f"{key} {column}: unknown categories {unknown}")
+            rows[column] = pd.Categorical(rows[column], categories=categories)
+        else:
+            rows[column] = rows[column].astype(head[column].dtype)
+    return rows
+
+
+def _append_station(store, key, rows):
+    """Append rows encoded by _encode_rows to node `key`, return them
+    decoded. Fixed-format nodes are rewritten."""
+    storer = store.get_storer(key)
+    scales = getattr(storer.attrs, "scales", None) or {}
+    if storer.is_table:
+        store.append(key, rows)
+    else:
+        store.put(key, pd.concat([store.get(key), rows]))
+    return decode_table(rows.copy(), scales)
+
+
+def monthly_completeness(table):
+    """Fraction of the days of each month with a valid value (cleaned table)."""
+    counts = table.notna().resample("MS").sum()
+    return counts.div(counts.index.days_in_month, axis=0)
+
+
+def _replace_months(store, key, table):
+    """Replace rows of node `key` from the first month of table on."""
+    if key not in store:
+        store.put(key, table, format="table")
+        return
+    storer = store.get_storer(key)
+    if storer.is_table:
+        store.remove(key, where=f"index >= '{table.index[0]}'")
+        store.append(key, table)
+        return
+    old = store.get(key)
+    store.put(key, pd.concat([old[old.index < table.index[0]], table]))
+
+
+def update_completeness_matrix(path_matrix, completeness):
+    """Write {stat_id: monthly completeness} into the completeness matrix,
+    growing its month (and station) axis if needed."""
+    path_matrix = Path(path_matrix)
+    with open(path_matrix.with_suffix(".json"), encoding="utf-8") as file:
+        index = json.load(file)
+    values = np.load(path_matrix)
+    months = pd.DatetimeIndex(index["months"])
+    months_new = (
+        months.append([table.index for table in completeness.values()])
+        .unique()
+        .sort_values()
+    )
+    stations = index["stations"] + sorted(set(completeness) - set(index["stations"]))
+    if len(months_new) > len(months) or len(stations) > len(index["stations"]):
+        grown = np.full(
+            (values.shape[0], len(stations), len(months_new)), np.nan, np.float32
+        )
+        grown[:, : values.shape[1], months_new.get_indexer(months)] = values
+        values, months = grown, months_new
+
+    station_index = {stat_id: i for i, stat_id in enumerate(stations)}
+    for stat_id, table in completeness.items():
+        table = table.reindex(columns=index["parameters"])
+        positions = months.get_indexer(table.index)
+        values[:, station_index[stat_id], positions] = (
+            table.to_numpy().T.round(3) * 100
+        )
+
+    index = {
+        **index,
+        "stations": stations,
+        "months": months.strftime("%Y-%m-%d").tolist(),
+    }
+    path_tmp = path_matrix.with_suffix(".tmp.npy")
+    np.save(path_tmp, values)
+    with open(path_matrix.with_suffix(".json"), "w", encoding="utf-8") as file:
+        json.dump(index, file)
+    _replace_atomic(path_tmp, path_matrix)
+
+
+def _append_parquet(path_dataset, stat_id, table, name):
+    """Add table as file `name` to the partition of station, in the schema of
+    the existing files."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path_part = Path(path_dataset) / f"station={stat_id}"
+    path_part.mkdir(parents=True, exist_ok=True)
+    table = table.rename_axis("date").reset_index()
+    table["date"] = table["date"].astype("datetime64[ns]")
+    existing = sorted(path_part.glob("*.parquet"))
+    schema = pq.read_schema(existing[0]) if existing else None
+    if schema is not None:
+        schema = schema.remove_metadata()
+    path_tmp = path_part / f".{name}.tmp"
+    pq.write_table(
+        pa.Table.from_pandas(table, schema=schema, preserve_index=False),
+        path_tmp,
+        row_group_size=ROW_GROUP_SIZE,
+        compression="zstd",
+    )
+    os.replace(path_tmp, path_part / name)
+
+
+def _mtime(path):
+    return Path(path).stat().st_mtime_ns if Path(path).exists() else None
+
+
+def _publish_update(
+    manifest, version, epoch, updated, completeness, paths, path_matrix, path_manifest
+):
+    """Write completeness matrix and metadata of the updated stations, then
+    the manifest (atomically, last)."""
+    if Path(path_matrix).exists():
+        update_completeness_matrix(path_matrix, completeness)
+    if Path(FILE_METADATA).exists():
+        build_metadata(FILE_METADATA)
+
+    manifest = {
+        "version": version,
+        "epoch": epoch,
+        "stations": {
+            **{str(stat_id): v for stat_id, v in manifest["stations"].items()},
+            **{str(stat_id): version for stat_id in updated},
+        },
+        "files": {p.name: _mtime(p) for p in paths if p.exists()},
+        "updated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    path_manifest = Path(path_manifest)
+    path_tmp = path_manifest.with_suffix(".tmp.json")
+    with open(path_tmp, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    _replace_atomic(path_tmp, path_manifest)
+
+
+def update_stations(
+    path_new,
+    path=FILE_BMKG,
+    path_completeness=FILE_COMPLETENESS,
+    path_matrix=FILE_COMPLETENESS_MATRIX,
+    path_manifest=FILE_MANIFEST,
+):
+    """Append new daily rows (see read_new_rows) and publish a new data
+    version. Rows of every station are checked and encoded first, a station
+    that does not fit aborts the update before anything is written.
+
+    Work is proportional to the new rows: each station is appended under an
+    exclusive lock (readers wait only for that station), completeness is
+    recomputed from the first updated month on, the completeness matrix and
+    the Parquet dataset (if built) get the same rows. The manifest is written
+    last and atomically; running workers then drop only cached data of the
+    updated stations. Cube and aggregates are not touched: updated stations
+    are read from HDF5 (and shown daily) until they are rebuilt.
+    """
+    manifest = read_manifest()
+    paths = [
+        Path(path),
+        Path(path_completeness),
+        Path(path_matrix),
+        DATASET_BMKG,
+        DATASET_COMPLETENESS,
+    ]
+    # a file replaced outside of updates invalidates every cached station
+    is_replaced = any(
+        manifest["files"].get(p.name, _mtime(p)) != _mtime(p) for p in paths
+    )
+    version = manifest["version"] + 1
+    epoch = manifest["epoch"] + int(is_replaced)
+    stations_known = set(read_metadata().index)
+    has_parquet = DATASET_BMKG.exists()
+
+    # every station is checked and encoded before anything is written
+    new_rows = {}
+    with store_lock(path), pd.HDFStore(path, mode="r") as store:
+        for stat_id, rows in read_new_rows(path_new).items():
+            if stat_id not in stations_known:
+                print(f"skipped: {stat_id}, not in /metadata/files")
+                continue
+            rows = _encode_rows(store, f"/stations/sta{stat_id}", rows)
+            if not rows.empty:
+                new_rows[stat_id] = rows
+    if not new_rows:
+        print("nothing to update")
+        return
+
+    updated, completeness = [], {}
+    try:
+        for stat_id, rows in new_rows.items():
+            key = f"/stations/sta{stat_id}"
+            with store_lock(path, exclusive=True), pd.HDFStore(
+                path, mode="a"
+            ) as store:
+                appended = _append_station(store, key, rows)
+            updated.append(stat_id)
+
+            month = appended.index[0].to_period("M").start_time
+            table = read_station_table(path, stat_id, start=month, cache=False)
+            completeness[stat_id] = monthly_completeness(table)
+            with store_lock(path_completeness, exclusive=True), pd.HDFStore(
+                path_completeness, mode="a"
+            ) as store:
+                _replace_months(store, key, completeness[stat_id])
+
+            if has_parquet:
+                rows_clean = table.loc[appended.index[0] :]
+                name = f"part-{version}.parquet"
+                _append_parquet(DATASET_BMKG, stat_id, rows_clean, name)
+                with pd.HDFStore(path_completeness, mode="r") as store:
+                    table_completeness = store.get(key)
+                # completeness partition is small, rewritten whole
+                _append_parquet(
+                    DATASET_COMPLETENESS, stat_id, table_completeness, "part-0.parquet"
+                )
+            print(f"updated: {stat_id} (+{len(appended)} rows)")
+    finally:
+        # stations appended before a failure are published too, so workers
+        # drop their cached data and a rerun does not skip them silently
+        if updated:
+            _publish_update(
+                manifest,
+                version,
+                epoch,
+                updated,
+                completeness,
+                paths,
+                path_matrix,
+                path_manifest,
+            )
+
+
+# CHECK: COMPACT SCHEMA
+def check_schema(path):
+    """Print, per parameter, the [SCHEMA] dtype and largest round-trip error
+    of encode_table over every cleaned station table, and the memory of the
+    tables before/after compact_table. Nothing is written."""
+    errors = {}
+    nbytes, nbytes_compact = 0, 0
+    with pd.HDFStore(path, mode="r") as store:
+        for _, key in _station_keys(store):
+            table = get_table(store, key)
+            clean_table(table)
+            encoded, scales = encode_table(table)
+            decoded = decode_table(encoded, scales)
+            for column, error in roundtrip_error(table, decoded).items():
+                errors[column] = max(errors.get(column, 0.0), error)
+            nbytes += table.memory_usage(deep=True).sum()
+            nbytes_compact += compact_table(table).memory_usage(deep=True).sum()
+
+    for column, error in errors.items():
+        kind, scale = schema(column)
+        kind = f"{kind}:{scale}" if kind == "int16" else kind
+        status = "ok" if error <= SCHEMA_MAX_ERROR else "LOSSY"
+        print(f"{column:>10} {kind:>10} max error {error:<10.3g} {status}")
+    print(
+        f"memory: {nbytes / 1024**2:.1f} MB -> {nbytes_compact / 1024**2:.1f} MB "
+        f"({nbytes / max(nbytes_compact, 1):.1f}x)"
+    )
+
+
+# BUILD: METADATA SIDECAR
+def build_metadata(path_metadata):
+    """Write station metadata as JSON so workers start without opening the
+    database."""
+    path_metadata = Path(path_metadata)
+    metadata = read_metadata()
+    path_tmp = path_metadata.with_suffix(".tmp.json")
+    with open(path_tmp, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "index_name": metadata.index.name,
+                "index": metadata.index.tolist(),
+                "columns": metadata.columns.tolist(),
+                "data": metadata.astype(object).where(metadata.notna()).values.tolist(),
+            },
+            file,
+            default=str,
+        )
+    _replace_atomic(path_tmp, path_metadata)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_table = subparsers.add_parser(
+        "table", help="convert HDF5 stores to queryable table format"
+    )
+    parser_table.add_argument(
+        "files",
+        nargs="*",
+        type=Path,
+        default=[FILE_BMKG, FILE_COMPLETENESS],
+        help="HDF5 files (default: both files in config.ini)",
+    )
+    parser_table.add_argument(
+        "--clean",
+        action="store_true",
+        help="replace sentinel values of station tables at ingest "
+        "(observation store only)",
+    )
+    parser_table.add_argument(
+        "--compact",
+        action="store_true",
+        help="also store station tables in the [SCHEMA] dtypes (implies --clean, "
+        "observation store only)",
+    )
+
+    parser_completeness = subparsers.add_parser(
+        "completeness", help="pack completeness store into one matrix (.npy)"
+    )
+    parser_completeness.add_argument("--file", type=Path, default=FILE_COMPLETENESS)
+    parser_completeness.add_argument(
+        "--output", type=Path, default=FILE_COMPLETENESS_MATRIX
+    )
+
+    parser_parquet = subparsers.add_parser(
+        "parquet", help="convert HDF5 stores to Parquet dataset (needs pyarrow)"
+    )
+    parser_parquet.add_argument("--file", type=Path, default=FILE_BMKG)
+    parser_parquet.add_argument(
+        "--file-completeness", type=Path, default=FILE_COMPLETENESS
+    )
+    parser_parquet.add_argument("--output", type=Path, default=FOLDER_PARQUET)
+
+    parser_cube = subparsers.add_parser(
+        "cube", help="materialize cleaned stations into a memory-mapped cube"
+    )
+    parser_cube.add_argument("--file", type=Path, default=FILE_BMKG)
+    parser_cube.add_argument("--output", type=Path, default=FILE_CUBE)
+
+    parser_aggregates = subparsers.add_parser(
+        "aggregates", help="resample cleaned stations to monthly and yearly cubes"
+    )
+    parser_aggregates.add_argument("--file", type=Path, default=FILE_BMKG)
+
+    parser_schema = subparsers.add_parser(
+        "schema", help="check round-trip error and memory of the [SCHEMA] dtypes"
+    )
+    parser_schema.add_argument("--file", type=Path, default=FILE_BMKG)
+
+    parser_metadata = subparsers.add_parser(
+        "metadata", help="write station metadata to a JSON sidecar"
+    )
+    parser_metadata.add_argument("--output", type=Path, default=FILE_METADATA)
+
+    parser_update = subparsers.add_parser(
+        "update",
+        help="append new daily rows (CSV/Parquet of the export route or HDF5)",
+    )
+    parser_update.add_argument("input", type=Path)
+    parser_update.add_argument("--file", type=Path, default=FILE_BMKG)
+    parser_update.add_argument(
+        "--file-completeness", type=Path, default=FILE_COMPLETENESS
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "table":
+        for path in args.files:
+            # completeness holds 0-1 fractions, no sentinels, no [SCHEMA]
+            is_observation = path.resolve() != FILE_COMPLETENESS.resolve()
+            convert_to_table(
+                path,
+                clean=args.clean and is_observation,
+                compact=args.compact and is_observation,
+            )
+    elif args.command == "completeness":
+        build_completeness_matrix(args.file, args.output)
+    elif args.command == "parquet":
+        build_parquet(args.file, args.file_completeness, args.output)
+    elif args.command == "cube":
+        build_station_cube(args.file, args.output)
+    elif args.command == "aggregates":
+        build_aggregates(args.file, FILE_AGGREGATE)
+    elif args.command == "schema":
+        check_schema(args.file)
+    elif args.command == "metadata":
+        build_metadata(args.output)
+    elif args.command == "update":
+        update_stations(args.input, args.file, args.file_completeness)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # windows, filesystem lock is per process only
+    fcntl = None
+
+# OBJECTS OWNING THREAD LOCKS, RENEWED IN FORKED CHILDREN (SEE _after_fork)
+_lock_owners = weakref.WeakSet()
+
+
+def _after_fork():
+    """A lock held by a thread of the parent while forking (background
+    callback job) stays locked forever in the child: give every cache of
+    this process new ones."""
+    for owner in list(_lock_owners):
+        owner._reset_locks()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size (bytes) of its values."""
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._reset_locks()
+        _lock_owners.add(self)
+
+    def _reset_locks(self):
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+
+    def discard(self, predicate):
+        """Remove every entry whose key satisfies predicate(key)."""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                self._bytes -= self._data.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "items": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class StripedLock:
+    """Fixed pool of locks, a key always maps to the same lock."""
+
+    def __init__(self, n=64):
+        self.n = n
+        self._reset_locks()
+        _lock_owners.add(self)
+
+    def _reset_locks(self):
+        self._locks = [threading.Lock() for _ in range(self.n)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+# FIGURE CACHE BACKENDS (VALUES ARE BYTES)
+# lock(key) SERIALIZES BUILDS OF ONE KEY AMONG EVERYONE SHARING THE BACKEND
+class MemoryBackend:
+    """In-process LRU, bounded by bytes, entries expire after `ttl` seconds."""
+
+    def __init__(self, max_bytes, ttl):
+        self.ttl = ttl
+        self._cache = LRUCache(max_bytes, lambda item: len(item[1]))
+        self.lock = StripedLock()
+
+    def get(self, key):
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            self._cache.pop(key)
+            return None
+        return value
+
+    def set(self, key, value):
+        self._cache.put(key, (time.monotonic() + self.ttl, value))
+
+    def clear(self):
+        self._cache.clear()
+
+
+class FileSystemBackend:
+    """One file per entry in `directory`, shared by every worker on the host.
+
+    Entries expire `ttl` seconds after being written; when the folder grows
+    over `max_bytes` the oldest files are removed. The folder is scanned once
+    every `prune_fraction * max_bytes` bytes written by this process, not on
+    every write.
+    """
+
+    def __init__(self, directory, max_bytes, ttl, prune_fraction=0.1):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prune_bytes = max(int(max_bytes * prune_fraction), 1)
+        self._written = 0
+        self._thread_lock = StripedLock()
+        self._reset_locks()
+        _lock_owners.add(self)
+        self._prune()
+
+    def _reset_locks(self):
+        self._written_lock = threading.Lock()
+
+    def _path(self, key):
+        return self.directory / f"{hashlib.sha1(key.encode()).hexdigest()}.pkl"
+
+    @contextmanager
+    def lock(self, key):
+        """Exclusive lock of key across processes (flock, released by the OS
+        if the holder dies)."""
+        with self._thread_lock(key):
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(key).with_suffix(".lock"), "a") as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if path.stat().st_mtime + self.ttl < time.time():
+                path.unlink(missing_ok=True)
+                return None
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        path_tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        path_tmp.write_bytes(value)
+        os.replace(path_tmp, path)
+        with self._written_lock:
+            self._written += len(value)
+            if self._written < self.prune_bytes:
+                return
+            self._written = 0
+        self._prune()
+
+    def _prune(self):
+        """Remove expired entries, then the oldest ones over `max_bytes`, each
+        with its lock file; also lock and tmp files left by failed builds."""
+        now = time.time()
+        files = []
+        for path in self.directory.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.suffix == ".pkl":
+                files.append((stat.st_mtime, stat.st_size, path))
+            elif stat.st_mtime + self.ttl < now and not (
+                path.suffix == ".lock" and path.with_suffix(".pkl").exists()
+            ):
+                path.unlink(missing_ok=True)
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes and mtime + self.ttl >= now:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".lock").unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for path in self.directory.iterdir():
+            if path.suffix in (".pkl", ".lock", ".tmp"):
+                path.unlink(missing_ok=True)
+
+
+class RedisBackend:
+    """Redis (or any server speaking its protocol) at `url`, needs `redis`.
+
+    Entries expire after `ttl` seconds; size-based eviction is done by the
+    server (`maxmemory` with an `allkeys-lru` policy).
+    """
+
+    def __init__(self, url, ttl, prefix="figure:", lock_timeout=300):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+
+    def lock(self, key):
+        """Lock shared by every host, expires after `lock_timeout` seconds if
+        the holder dies."""
+        return self.client.lock(f"{self.prefix}lock:{key}", timeout=self.lock_timeout)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+
+class FigureCache:
+    """Memoize figure builders on their arguments and the data version of
+    the arguments (`version(*args)`).
+
+    List arguments (stations) are keyed in sorted order, so a memoized
+    builder must not depend on the order of its stations.
+
+    Figures are stored as pickled plotly dicts, so any backend holding bytes
+    works and a hit skips both the build and plotly's validation. Identical
+    builds in flight are done once: later callers wait on the backend lock
+    and read the result of the first one (`shared`).
+    """
+
+    def __init__(self, backend, version):
+        self.backend = backend
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def memoize(self, func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            if self.backend is None:
+                return func(*args)
+            key = ":".join(
+                [func.__qualname__, *(repr(_hashable(arg)) for arg in args)]
+                + [str(self.version(*args))]
+            )
+            value = self.backend.get(key)
+            if value is not None:
+                self.hits += 1
+                return pickle.loads(value)
+            with self.backend.lock(key):
+                value = self.backend.get(key)
+                if value is not None:
+                    self.shared += 1
+                    return pickle.loads(value)
+                self.misses += 1
+                figure = func(*args)
+                if hasattr(figure, "to_dict"):
+                    figure = figure.to_dict()
+                self.backend.set(key, pickle.dumps(figure, pickle.HIGHEST_PROTOCOL))
+            return figure
+
+        return wrapper
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "shared": self.shared}
+
+
+def _hashable(arg):
+    # list arguments are stations: any order of a selection is the same figure
+    return tuple(sorted(arg)) if isinstance(arg, list) else arg
+
+
+def create_backend(name, max_bytes, ttl, directory=None, url=None):
+    """Backend from its config name: memory, filesystem, redis or none."""
+    if name == "memory":
+        return MemoryBackend(max_bytes, ttl)
+    if name == "filesystem":
+        return FileSystemBackend(directory, max_bytes, ttl)
+    if name == "redis":
+        return RedisBackend(url, ttl)
+    if name == "none":
+        return None
+    raise ValueError(f"unknown cache backend: {name}")
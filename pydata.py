@@ -0,0 +1,812 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pymetrics
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from pycache import LRUCache
+
+try:
+    import fcntl
+except ImportError:  # windows, no lock between updater and readers
+    fcntl = None
+
+# CONFIG
+CONFIG_PATH = "config.ini"
+config = configparser.ConfigParser()
+config.optionxform = str  # keep case of parameter names
+config.read(CONFIG_PATH)
+STATION_CACHE_MB = float(config["CACHE"]["STATION_CACHE_MB"])
+LOADER_THREADS = int(config["CONCURRENCY"]["LOADER_THREADS"])
+
+# STORAGE
+FOLDER_BMKG = Path(config["PATH BMKG DATABASE"]["FOLDER_BMKG"])
+FILE_BMKG = FOLDER_BMKG / config["PATH BMKG DATABASE"]["FILE_NAME_BMKG"]
+FILE_COMPLETENESS = (
+    FOLDER_BMKG / config["PATH BMKG DATABASE"]["FILE_NAME_BMKG_COMPLETENESS"]
+)
+FILE_COMPLETENESS_MATRIX = (
+    FOLDER_BMKG / config["PATH BMKG DATABASE"]["FILE_NAME_BMKG_COMPLETENESS_MATRIX"]
+)
+FILE_CUBE = FOLDER_BMKG / config["STORAGE"]["FILE_NAME_CUBE"]
+FILE_METADATA = FOLDER_BMKG / config["STORAGE"]["FILE_NAME_METADATA"]
+FILE_MANIFEST = FOLDER_BMKG / config["STORAGE"]["FILE_NAME_MANIFEST"]
+STORAGE_BACKEND = config["STORAGE"]["BACKEND"]
+FOLDER_PARQUET = Path(config["STORAGE"]["FOLDER_PARQUET"])
+DATASET_BMKG = FOLDER_PARQUET / "stations"
+DATASET_COMPLETENESS = FOLDER_PARQUET / "completeness"
+FILE_METADATA_PARQUET = FOLDER_PARQUET / "metadata.parquet"
+
+# AGGREGATE LEVELS (RESAMPLE FREQUENCY), COARSEST FIRST
+AGGREGATE_LEVELS = {"yearly": "YS", "monthly": "MS"}
+FILE_AGGREGATE = {
+    level: FOLDER_BMKG / config["STORAGE"]["FILE_NAME_AGGREGATE"].format(level=level)
+    for level in AGGREGATE_LEVELS
+}
+
+
+def _parse_values(text):
+    return tuple(float(value) for value in text.split(",") if value.strip())
+
+
+# SENTINEL VALUES (REPLACED WITH NaN)
+SENTINEL_DEFAULT = _parse_values(config["SENTINEL"]["DEFAULT"])
+SENTINEL_PARAMETER = {
+    parameter: _parse_values(values)
+    for parameter, values in config["SENTINEL"].items()
+    if parameter != "DEFAULT"
+}
+
+
+# AGGREGATE METHOD (mean, min, max, sum OR circular)
+AGGREGATE_METHOD_DEFAULT = config["AGGREGATE"]["DEFAULT"]
+AGGREGATE_SUM_MIN_FRACTION = float(config["AGGREGATE"]["SUM_MIN_FRACTION"])
+AGGREGATE_METHOD = {
+    parameter: method
+    for parameter, method in config["AGGREGATE"].items()
+    if parameter not in ("DEFAULT", "SUM_MIN_FRACTION")
+}
+
+
+def aggregate_method(parameter):
+    return AGGREGATE_METHOD.get(parameter, AGGREGATE_METHOD_DEFAULT)
+
+
+# COMPACT SCHEMA OF CLEANED STATION TABLES
+SCHEMA_KINDS = ["float64", "float32", "int16", "category"]
+INT16_MISSING = np.iinfo(np.int16).min
+
+
+def _parse_schema(text):
+    """`kind` or `int16:<scale>` -> (kind, scale)."""
+    kind, _, scale = text.partition(":")
+    kind = kind.strip()
+    if kind not in SCHEMA_KINDS:
+        raise ValueError(f"unknown schema dtype: {text}")
+    return kind, int(scale) if scale.strip() else 1
+
+
+SCHEMA_COMPACT = bool(int(config["SCHEMA"]["COMPACT"]))
+SCHEMA_MAX_ERROR = float(config["SCHEMA"]["MAX_ERROR"])
+SCHEMA_DEFAULT = _parse_schema(config["SCHEMA"]["DEFAULT"])
+SCHEMA_PARAMETER = {
+    parameter: _parse_schema(text)
+    for parameter, text in config["SCHEMA"].items()
+    if parameter not in ["COMPACT", "MAX_ERROR", "DEFAULT"]
+}
+
+
+def schema(parameter):
+    return SCHEMA_PARAMETER.get(parameter, SCHEMA_DEFAULT)
+
+
+def is_numeric(parameter):
+    """False for text parameters ([SCHEMA] category, e.g. ddd_car)."""
+    return schema(parameter)[0] != "category"
+
+
+def compact_table(df):
+    """Return df with its columns in the in-memory dtype of [SCHEMA]: numbers
+    as float32 (int16 is a storage format, see encode_table), text as
+    category where configured, float64 left as is."""
+    dtypes = {}
+    for column in df.columns:
+        kind, _ = schema(column)
+        if kind == "float64":
+            continue
+        if pd.api.types.is_float_dtype(df[column]):
+            dtypes[column] = np.float32
+        elif kind == "category" and df[column].dtype == object:
+            dtypes[column] = "category"
+    return df.astype(dtypes) if dtypes else df
+
+
+def encode_table(df):
+    """Return (table, scales) to store: compact_table, then int16 columns
+    multiplied by their scale and rounded, NaN as INT16_MISSING. Raise
+    ValueError if a value does not fit in int16."""
+    table = compact_table(df)
+    scales = {}
+    for column in table.columns:
+        kind, scale = schema(column)
+        if kind != "int16" or not pd.api.types.is_float_dtype(table[column]):
+            continue
+        table[column] = encode_int16(df[column], scale, column)
+        scales[column] = scale
+    return table, scales
+
+
+def encode_int16(values, scale, name=""):
+    """values x scale rounded to int16, NaN as INT16_MISSING."""
+    values = np.asarray(values, dtype=float) * scale
+    is_valid = ~np.isnan(values)
+    if np.abs(values[is_valid]).max(initial=0) > np.iinfo(np.int16).max:
+        raise ValueError(f"{name} does not fit in int16 with scale {scale}")
+    encoded = np.full(values.shape, INT16_MISSING, dtype=np.int16)
+    encoded[is_valid] = np.round(values[is_valid])
+    return encoded
+
+
+def decode_table(df, scales):
+    """Turn int16 columns of encode_table back into float32 with NaN, in place."""
+    for column, scale in scales.items():
+        if column not in df:
+            continue
+        values = df[column].to_numpy()
+        decoded = values.astype(np.float32) / np.float32(scale)
+        decoded[values == INT16_MISSING] = np.nan
+        df[column] = decoded
+    return df
+
+
+def roundtrip_error(original, decoded):
+    """Max absolute difference per column of decoded vs original table, inf if
+    missing values (or text) differ."""
+    errors = {}
+    for column in original.columns:
+        a, b = original[column], decoded[column]
+        if not pd.api.types.is_numeric_dtype(a):
+            is_equal = a.astype(object).equals(b.astype(object))
+            errors[column] = 0.0 if is_equal else np.inf
+            continue
+        a, b = a.to_numpy(dtype=float), b.to_numpy(dtype=float)
+        is_valid = ~np.isnan(a)
+        if not np.array_equal(is_valid, ~np.isnan(b)):
+            errors[column] = np.inf
+            continue
+        errors[column] = float(np.abs(a - b)[is_valid].max(initial=0))
+    return errors
+
+
+def check_roundtrip(original, decoded, name=""):
+    """Raise ValueError if a column of decoded differs from original by more
+    than [SCHEMA] MAX_ERROR."""
+    errors = roundtrip_error(original, decoded)
+    failed = {
+        column: error for column, error in errors.items() if error > SCHEMA_MAX_ERROR
+    }
+    if failed:
+        raise ValueError(f"compact schema is lossy for {name}: {failed}")
+    return errors
+
+
+def _is_block_view(df, values):
+    """True if `values` (df.to_numpy()) is a writable view of df's data."""
+    return (
+        values.dtype.kind == "f"
+        and values.flags.writeable
+        and np.may_share_memory(values, df.iloc[:, 0].to_numpy())
+    )
+
+
+def clean_table(df, columns=None):
+    """Replace sentinel values (see [SENTINEL] in config.ini) to np.nan, in place.
+
+    Columns sharing the same sentinel set are masked in one np.isin pass over
+    their values; non-numeric columns are left untouched.
+    """
+    columns = df.select_dtypes("number").columns if columns is None else columns
+    groups = {}
+    for column in columns:
+        sentinel = SENTINEL_PARAMETER.get(column, SENTINEL_DEFAULT)
+        groups.setdefault(sentinel, []).append(column)
+
+    for sentinel, group in groups.items():
+        if not sentinel:
+            continue
+        if len(group) == df.shape[1]:
+            values = df.to_numpy()
+            if _is_block_view(df, values):
+                # single float block, masked without going through setitem
+                values[np.isin(values, sentinel)] = np.nan
+                continue
+        values = df[group].to_numpy(dtype=float, copy=True)
+        is_sentinel = np.isin(values, sentinel)
+        if is_sentinel.any():
+            values[is_sentinel] = np.nan
+            df[group] = values
+    return df
+
+
+# DATA VERSION (MANIFEST OF `python pybuild.py update`)
+_manifest = {}
+_manifest_lock = threading.Lock()
+
+
+def _empty_manifest():
+    return {"version": 0, "epoch": 0, "stations": {}, "files": {}}
+
+
+def read_manifest():
+    """Return manifest of published updates, reread when it changes:
+    `version` (+1 per update), `epoch` (+1 when a file was replaced outside
+    of updates), `stations` {stat_id: version of its last update} and
+    `files` {file name: mtime_ns when published}. Shared, do not modify."""
+    mtime = FILE_MANIFEST.stat().st_mtime_ns if FILE_MANIFEST.exists() else None
+    with _manifest_lock:
+        if "value" not in _manifest or _manifest["mtime"] != mtime:
+            manifest = _empty_manifest()
+            if mtime is not None:
+                with open(FILE_MANIFEST, encoding="utf-8") as file:
+                    manifest.update(json.load(file))
+                manifest["stations"] = {
+                    int(stat_id): version
+                    for stat_id, version in manifest["stations"].items()
+                }
+            _manifest["value"] = manifest
+            _manifest["mtime"] = mtime
+        return _manifest["value"]
+
+
+def station_version(stat_id):
+    """Manifest version of the last update of station, 0 if never updated."""
+    return read_manifest()["stations"].get(int(stat_id), 0)
+
+
+def _is_published(path, mtime):
+    """True if `path` was last written by a published update."""
+    return read_manifest()["files"].get(Path(path).name) == mtime
+
+
+def _table_nbytes(table):
+    return int(table.memory_usage(index=True, deep=True).sum())
+
+
+def get_table(store, key):
+    """Return node `key` of an open HDFStore with int16 columns decoded."""
+    scales = getattr(store.get_storer(key).attrs, "scales", None) or {}
+    return decode_table(store.get(key), scales)
+
+
+# STATION TABLE CACHE (PER PROCESS)
+station_cache = LRUCache(int(STATION_CACHE_MB * 1024**2), _table_nbytes)
+_store_mtime = {}
+_store_mtime_lock = threading.Lock()
+
+
+def _check_mtime(path):
+    """Drop cached tables of `path` if the file changed since last read. For
+    published updates (Parquet parts do not change the dataset mtime), only
+    tables of the updated stations are dropped."""
+    mtime = path.stat().st_mtime_ns
+    version = read_manifest()["version"]
+    with _store_mtime_lock:
+        seen = _store_mtime.get(path)
+        if seen == (mtime, version):
+            return
+        _store_mtime[path] = (mtime, version)
+    if seen is not None and (seen[0] == mtime or _is_published(path, mtime)):
+        updated = {
+            stat_id
+            for stat_id, updated_in in read_manifest()["stations"].items()
+            if updated_in > seen[1]
+        }
+        station_cache.discard(lambda key: key[0] == path and int(key[1]) in updated)
+        return
+    station_cache.discard(lambda key: key[0] == path)
+
+
+# HDF5 ACCESS
+_hdf5_lock = threading.Lock()
+
+
+@contextmanager
+def store_lock(path, exclusive=False):
+    """Lock of HDF5 file `path` between processes: shared while reading,
+    exclusive while `python pybuild.py update` appends to it. Only the
+    updater creates the lock file; readers open it read-only and skip the
+    lock if it does not exist (never updated, or a read-only data folder)."""
+    if fcntl is None:
+        yield
+        return
+    path = Path(path)
+    path_lock = path.with_name(path.name + ".lock")
+    try:
+        file = open(path_lock, "a" if exclusive else "r")
+    except FileNotFoundError:
+        yield
+        return
+    with file:
+        fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def open_store(path):
+    """Open HDF5 store read-only for the calling thread.
+
+    PyTables handles must not be shared between threads and its file registry
+    is not thread-safe, so every read gets its own handle and only opening and
+    closing are serialized. Updates wait until the handle is closed.
+    """
+    with store_lock(path):
+        with _hdf5_lock, pymetrics.span("hdf5_open"):
+            store = pd.HDFStore(path, mode="r")
+        try:
+            yield store
+        finally:
+            with _hdf5_lock:
+                store.close()
+
+
+# STATION LOADER (PER PROCESS)
+loader = ThreadPoolExecutor(max_workers=LOADER_THREADS, thread_name_prefix="loader")
+
+
+def _after_fork():
+    """A forked child (background callback job) has none of the threads of
+    its parent: a copied pool would queue reads nobody runs and a lock held
+    by another thread would never be released. Locks of the LRU caches are
+    renewed by pycache, those of the metrics registry by pymetrics."""
+    global loader, _hdf5_lock, _store_mtime_lock, _manifest_lock, _metadata_lock
+    loader = ThreadPoolExecutor(max_workers=LOADER_THREADS, thread_name_prefix="loader")
+    _hdf5_lock = threading.Lock()
+    _store_mtime_lock = threading.Lock()
+    _manifest_lock = threading.Lock()
+    _metadata_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _where_daterange(start, end):
+    where = []
+    if start is not None:
+        where.append(f"index >= '{start}'")
+    if end is not None:
+        where.append(f"index <= '{end}'")
+    return where or None
+
+
+def _read_table(path, stat_id, columns, start, end):
+    """Read only `columns` within [start, end]; projection happens on disk for
+    table-format nodes, fixed-format nodes are read whole and sliced.
+
+    Return (table, is_cleaned), is_cleaned is True if sentinels were already
+    removed at ingest (`python pybuild.py table --clean`). int16 columns of
+    `table --compact` are decoded.
+    """
+    key = f"/stations/sta{stat_id}"
+    with open_store(path) as store, pymetrics.span("hdf5_read"):
+        storer = store.get_storer(key)
+        is_cleaned = bool(getattr(storer.attrs, "cleaned", False))
+        scales = getattr(storer.attrs, "scales", None) or {}
+        if storer.is_table:
+            table = store.select(
+                key, where=_where_daterange(start, end), columns=columns
+            )
+            return decode_table(table, scales), is_cleaned
+        table = decode_table(store.get(key), scales)
+    if columns is not None:
+        table = table[columns]
+    if start is not None or end is not None:
+        table = table.loc[start:end].copy()
+    return table, is_cleaned
+
+
+def read_station_table(
+    path, stat_id, columns=None, start=None, end=None, clean=True, cache=True
+):
+    """Return table of station from HDF5 store. Shared, do not modify.
+
+    `columns` limits the parameters read and `start`/`end` the date range.
+    With `cache=False` the table is not added to the station cache.
+    """
+    path = Path(path)
+    columns = None if columns is None else list(columns)
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    _check_mtime(path)
+    columns_key = None if columns is None else tuple(columns)
+    key = (path, stat_id, columns_key, start, end, clean)
+    table = station_cache.get(key)
+    if table is None:
+        table, is_cleaned = _read_table(path, stat_id, columns, start, end)
+        if pymetrics.ENABLED:
+            pymetrics.inc("bmkg_station_reads_total")
+            pymetrics.inc("bmkg_station_read_rows_total", len(table))
+            pymetrics.inc("bmkg_station_read_bytes_total", _table_nbytes(table))
+        if clean and not is_cleaned:
+            with pymetrics.span("clean_table"):
+                clean_table(table)
+        if clean and SCHEMA_COMPACT:
+            table = compact_table(table)
+        if cache:
+            station_cache.put(key, table)
+    return table
+
+
+def read_station_series(path, stat_id, parameter, start=None, end=None, clean=True):
+    """Return single parameter of station as series."""
+    table = read_station_table(path, stat_id, [parameter], start, end, clean)
+    return table[parameter]
+
+
+# PARQUET DATASET
+def _read_parquet(path, stations, columns, start, end):
+    """Read `columns` of stations within [start, end] in one dataset scan.
+
+    Only the station partitions, parameter columns and row groups (by date
+    statistics) that match are read. Return {stat_id: table}.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    dataset = ds.dataset(
+        path,
+        format="parquet",
+        partitioning="hive",
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+    expression = ds.field("station").isin([int(stat_id) for stat_id in stations])
+    if start is not None:
+        expression &= ds.field("date") >= start
+    if end is not None:
+        expression &= ds.field("date") <= end
+    with pymetrics.span("parquet_read"):
+        table = dataset.to_table(
+            columns=["station", "date", *columns], filter=expression
+        ).to_pandas()
+    pymetrics.inc("bmkg_station_read_rows_total", len(table))
+    tables = {
+        stat_id: group.set_index("date")[columns].rename_axis(None)
+        for stat_id, group in table.groupby("station", sort=False)
+    }
+    return {
+        stat_id: tables.get(int(stat_id), pd.DataFrame(columns=columns))
+        for stat_id in stations
+    }
+
+
+def read_parquet_tables(path, stations, columns, start=None, end=None, cache=True):
+    """Return {stat_id: table} from Parquet dataset, cached per station unless
+    `cache=False`.
+
+    The dataset is cleaned at ingest (`python pybuild.py parquet`).
+    """
+    path = Path(path)
+    columns = list(columns)
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    _check_mtime(path)
+
+    def key(stat_id):
+        return (path, stat_id, tuple(columns), start, end, True)
+
+    tables = {stat_id: station_cache.get(key(stat_id)) for stat_id in stations}
+    missing = [stat_id for stat_id, table in tables.items() if table is None]
+    if missing:
+        for stat_id, table in _read_parquet(path, missing, columns, start, end).items():
+            if SCHEMA_COMPACT:
+                table = compact_table(table)
+            if cache:
+                station_cache.put(key(stat_id), table)
+            tables[stat_id] = table
+    return tables
+
+
+# BACKEND
+def _read_metadata_source():
+    if FILE_METADATA.exists() and (
+        FILE_METADATA.stat().st_mtime_ns >= _metadata_source().stat().st_mtime_ns
+    ):
+        with open(FILE_METADATA, encoding="utf-8") as file:
+            metadata = json.load(file)
+        return pd.DataFrame(
+            metadata["data"],
+            index=pd.Index(metadata["index"], name=metadata["index_name"]),
+            columns=metadata["columns"],
+        )
+    if STORAGE_BACKEND == "parquet":
+        return pd.read_parquet(FILE_METADATA_PARQUET)
+    with open_store(FILE_BMKG) as store:
+        return store.get("/metadata/files")
+
+
+def _metadata_source():
+    return FILE_METADATA_PARQUET if STORAGE_BACKEND == "parquet" else FILE_BMKG
+
+
+_metadata = {}
+_metadata_lock = threading.Lock()
+
+
+def read_metadata():
+    """Return metadata of stations (`/metadata/files`). Read on first call and
+    cached until the source changes; the JSON sidecar (`python pybuild.py
+    metadata`) is used when it is up to date. Shared, do not modify."""
+    version = tuple(
+        path.stat().st_mtime_ns if path.exists() else 0
+        for path in [_metadata_source(), FILE_METADATA]
+    )
+    with _metadata_lock:
+        if _metadata.get("version") != version:
+            _metadata["table"] = _read_metadata_source()
+            _metadata["version"] = version
+        return _metadata["table"]
+
+
+def read_stations_series(stations, parameter, start=None, end=None, level="daily"):
+    """Return {stat_id: series} of cleaned parameter from configured backend,
+    or from the aggregate cube of `level` (see select_level)."""
+    if level != "daily":
+        aggregate = read_station_cube(FILE_AGGREGATE[level])
+        return {
+            stat_id: aggregate.series(stat_id, parameter, start, end)
+            for stat_id in stations
+        }
+    if STORAGE_BACKEND == "cube":
+        cube = read_station_cube(FILE_CUBE)
+        # no cube yet (not started by gunicorn), parameter not in the cube
+        # (text columns) or stations updated since the cube was built: read
+        # from HDF5
+        if cube is None or parameter not in cube.parameter_index:
+            stale = list(stations)
+        else:
+            stale = [stat_id for stat_id in stations if not cube.is_current(stat_id)]
+        series = dict(
+            zip(stale, read_stations_series_hdf5(stale, parameter, start, end))
+        )
+        return {
+            stat_id: series[stat_id]
+            if stat_id in series
+            else cube.series(stat_id, parameter, start, end)
+            for stat_id in stations
+        }
+    if STORAGE_BACKEND == "parquet":
+        tables = read_parquet_tables(DATASET_BMKG, stations, [parameter], start, end)
+        return {stat_id: table[parameter] for stat_id, table in tables.items()}
+    series = read_stations_series_hdf5(stations, parameter, start, end)
+    return dict(zip(stations, series))
+
+
+def read_stations_series_hdf5(stations, parameter, start=None, end=None):
+    """Series of stations from HDF5, read in parallel on the loader."""
+    return pymetrics.pool_map(
+        loader,
+        lambda stat_id: read_station_series(FILE_BMKG, stat_id, parameter, start, end),
+        stations,
+    )
+
+
+def iter_stations_tables(stations, columns, start=None, end=None, batch=8):
+    """Yield (stat_id, table) of cleaned columns, reading `batch` stations at a
+    time (HDF5 in parallel on the loader) without filling the station cache,
+    so memory stays at one batch whatever the number of stations. The cube
+    backend reads the HDF5 source, which holds every parameter."""
+    for i in range(0, len(stations), batch):
+        chunk = stations[i : i + batch]
+        if STORAGE_BACKEND == "parquet":
+            tables = read_parquet_tables(
+                DATASET_BMKG, chunk, columns, start, end, cache=False
+            )
+            yield from tables.items()
+            continue
+        tables = pymetrics.pool_map(
+            loader,
+            lambda stat_id: read_station_table(
+                FILE_BMKG, stat_id, columns, start, end, cache=False
+            ),
+            chunk,
+        )
+        yield from zip(chunk, tables)
+
+
+def read_stations_completeness(stations, parameter):
+    """Return {stat_id: series} of completeness (0-1) from configured backend."""
+    if STORAGE_BACKEND == "parquet":
+        tables = read_parquet_tables(DATASET_COMPLETENESS, stations, [parameter])
+        return {stat_id: table[parameter] for stat_id, table in tables.items()}
+    series = pymetrics.pool_map(
+        loader,
+        lambda stat_id: read_station_series(
+            FILE_COMPLETENESS, stat_id, parameter, clean=False
+        ),
+        stations,
+    )
+    return dict(zip(stations, series))
+
+
+# COMPLETENESS MATRIX
+class CompletenessMatrix:
+    """Completeness (%) of all stations packed as parameter x station x month.
+
+    Built by `python pybuild.py completeness`; the index map is stored in a
+    JSON sidecar next to the `.npy` file.
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path.with_suffix(".json"), encoding="utf-8") as file:
+            index = json.load(file)
+        self.values = np.load(path, mmap_mode="r")
+        self.station_index = {
+            stat_id: i for i, stat_id in enumerate(index["stations"])
+        }
+        self.parameter_index = {
+            parameter: i for i, parameter in enumerate(index["parameters"])
+        }
+        self.months = pd.DatetimeIndex(index["months"])
+
+    def __contains__(self, stat_id):
+        return int(stat_id) in self.station_index
+
+    def take(self, stations, parameter):
+        """Return (z, months) of stations, trimmed to months
+        where any of the stations has data."""
+        rows = [self.station_index[int(stat_id)] for stat_id in stations]
+        z = self.values[self.parameter_index[parameter]][rows].astype(float).round(1)
+        has_data = np.flatnonzero(~np.isnan(z).all(axis=0))
+        if has_data.size == 0:
+            return z[:, :0], self.months[:0]
+        window = slice(has_data[0], has_data[-1] + 1)
+        return z[:, window], self.months[window]
+
+
+# STATION CUBE
+class StationCube:
+    """Cleaned observations of all stations as one read-only memory-mapped
+    float32 array, parameter x station x date.
+
+    Built by `python pybuild.py cube` (or by gunicorn on start, see
+    gunicorn.conf.py). Workers share the pages of the file through the OS
+    page cache and every series is a zero-copy view. Aggregates
+    (`python pybuild.py aggregates`) use the same layout with a monthly or
+    yearly date axis (`freq` in the sidecar).
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path.with_suffix(".json"), encoding="utf-8") as file:
+            index = json.load(file)
+        self.values = np.load(path, mmap_mode="r")
+        self.station_index = {
+            stat_id: i for i, stat_id in enumerate(index["stations"])
+        }
+        self.parameter_index = {
+            parameter: i for i, parameter in enumerate(index["parameters"])
+        }
+        self.dates = pd.date_range(
+            index["start"], periods=self.values.shape[2], freq=index.get("freq", "D")
+        )
+        self.spans = index["spans"]
+        self.version = index.get("version", 0)
+
+    def __contains__(self, stat_id):
+        return int(stat_id) in self.station_index
+
+    def is_current(self, stat_id):
+        """True if station is in the cube and was not updated after the
+        cube was built."""
+        return stat_id in self and station_version(stat_id) <= self.version
+
+    def _window(self, stat_id, start, end):
+        first, last = self.spans[self.station_index[int(stat_id)]]
+        window = self.dates[first:last].slice_indexer(start, end)
+        return slice(first + window.start, first + window.stop)
+
+    def n_periods(self, stat_id, start=None, end=None):
+        """Number of dates of station within [start, end]."""
+        window = self._window(stat_id, start, end)
+        return max(window.stop - window.start, 0)
+
+    def series(self, stat_id, parameter, start=None, end=None):
+        """Return series of station (view of the array) within [start, end]."""
+        i = self.station_index[int(stat_id)]
+        window = self._window(stat_id, start, end)
+        return pd.Series(
+            self.values[self.parameter_index[parameter], i, window],
+            index=self.dates[window],
+            name=parameter,
+            copy=False,
+        )
+
+
+_mmap_arrays = {}
+
+
+def _read_mmap_array(cls, path):
+    """Return cached `cls(path)`, reloaded when the file changes. None if the
+    file is not built."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    mtime = path.stat().st_mtime_ns
+    cached = _mmap_arrays.get((cls, path))
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, cls(path))
+        _mmap_arrays[(cls, path)] = cached
+    return cached[1]
+
+
+def read_completeness_matrix(path):
+    """Return cached CompletenessMatrix of `path`, None if not built."""
+    return _read_mmap_array(CompletenessMatrix, path)
+
+
+def read_station_cube(path):
+    """Return cached StationCube of `path`, None if not built."""
+    return _read_mmap_array(StationCube, path)
+
+
+def select_level(stations, parameter, start=None, end=None, min_points=300):
+    """Coarsest aggregate level with at least `min_points` periods of any
+    station inside [start, end], "daily" if none (or none is built, or it
+    has no `parameter`)."""
+    for level, path in FILE_AGGREGATE.items():
+        aggregate = read_station_cube(path)
+        if (
+            aggregate is None
+            or parameter not in aggregate.parameter_index
+            or not all(aggregate.is_current(stat_id) for stat_id in stations)
+        ):
+            continue
+        n_points = max(
+            (aggregate.n_periods(stat_id, start, end) for stat_id in stations),
+            default=0,
+        )
+        if n_points >= min_points:
+            return level
+    return "daily"
+
+
+def data_version(stations=None):
+    """Token that changes whenever data of `stations` (all if None) changes.
+    Files written by a published update count by the manifest versions of
+    their updated stations, any other change of a file changes the token of
+    every station."""
+    manifest = read_manifest()
+    paths = [
+        FILE_BMKG,
+        FILE_COMPLETENESS,
+        FILE_COMPLETENESS_MATRIX,
+        FILE_CUBE,
+        *FILE_AGGREGATE.values(),
+        DATASET_BMKG,
+        DATASET_COMPLETENESS,
+    ]
+    tokens = [str(manifest["epoch"])]
+    for path in paths:
+        mtime = path.stat().st_mtime_ns if path.exists() else 0
+        tokens.append("u" if _is_published(path, mtime) else str(mtime))
+    if stations is None:
+        tokens.append(str(manifest["version"]))
+    else:
+        versions = manifest["stations"]
+        tokens.extend(str(versions.get(int(stat_id), 0)) for stat_id in stations)
+    return "-".join(tokens)
+
+
+def cache_info():
+    """Hit/miss counters of station cache."""
+    return station_cache.info()
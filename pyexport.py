@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import importlib.util
+import io
+import threading
+import pandas as pd
+import pydata
+import pymetrics
+
+# PARSE CONFIG
+CONFIG_PATH = "config.ini"
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+ROUTE = config["EXPORT"]["ROUTE"]
+BATCH_STATIONS = int(config["EXPORT"]["BATCH_STATIONS"])
+MAX_CONCURRENT = int(config["EXPORT"]["MAX_CONCURRENT"])
+
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+# PARQUET EXPORT NEEDS pyarrow (IMPORTED ON FIRST USE)
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file collecting what the Parquet writer wrote since the
+    last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _long_table(stat_id, table, parameters):
+    """station, date and parameters of one station table."""
+    table = table.reindex(columns=parameters).rename_axis("date").reset_index()
+    table.insert(0, "station", int(stat_id))
+    return table
+
+
+def stream_csv(stations, parameters, start=None, end=None):
+    """Yield CSV (station, date, parameters...) one batch of stations at a
+    time."""
+    yield ",".join(["station", "date", *parameters]) + "\n"
+    tables = pydata.iter_stations_tables(
+        stations, parameters, start, end, BATCH_STATIONS
+    )
+    for stat_id, table in tables:
+        with pymetrics.span("export_csv"):
+            chunk = _long_table(stat_id, table, parameters).to_csv(
+                index=False, header=False, date_format="%Y-%m-%d"
+            )
+        yield chunk
+
+
+def stream_parquet(stations, parameters, start=None, end=None):
+    """Yield a Parquet file (columns of stream_csv), one row group per station,
+    sent as soon as it is written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink, writer, schema = _Sink(), None, None
+    tables = pydata.iter_stations_tables(
+        stations, parameters, start, end, BATCH_STATIONS
+    )
+    try:
+        for stat_id, table in tables:
+            with pymetrics.span("export_parquet"):
+                table = _long_table(stat_id, table, parameters)
+                if writer is None:
+                    schema = pa.Schema.from_pandas(table, preserve_index=False)
+                    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+                writer.write_table(
+                    pa.Table.from_pandas(table, schema=schema, preserve_index=False)
+                )
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def _parse_list(text):
+    return [value.strip() for value in (text or "").split(",") if value.strip()]
+
+
+def parse_request(args, stations_known, parameters_known):
+    """Return (stations, parameters, start, end, format) of the query string,
+    raise ValueError with a message for the client if invalid."""
+    try:
+        stations = [int(stat_id) for stat_id in _parse_list(args.get("stations"))]
+    except ValueError:
+        raise ValueError("stations must be comma separated station IDs")
+    if not stations:
+        raise ValueError("stations is required, example: stations=96001,96011")
+    unknown = [stat_id for stat_id in stations if stat_id not in stations_known]
+    if unknown:
+        raise ValueError(f"unknown stations: {unknown}")
+
+    parameters = _parse_list(args.get("parameters")) or list(parameters_known)
+    unknown = [par for par in parameters if par not in parameters_known]
+    if unknown:
+        raise ValueError(f"unknown parameters: {unknown}")
+
+    try:
+        start, end = (
+            None if not args.get(key) else pd.Timestamp(args[key])
+            for key in ["start", "end"]
+        )
+    except ValueError:
+        raise ValueError("start and end must be dates, example: 2020-01-31")
+
+    file_format = args.get("format", "csv")
+    if file_format not in FORMATS:
+        raise ValueError(f"format must be one of {list(FORMATS)}")
+    return stations, parameters, start, end, file_format
+
+
+def _file_name(parameters, start, end, file_format):
+    dates = [
+        "all" if date is None else date.strftime("%Y%m%d") for date in [start, end]
+    ]
+    return f"bmkg_{'-'.join(parameters)}_{dates[0]}_{dates[1]}.{file_format}"
+
+
+# FLASK
+def init_flask(server, parameters):
+    """Register `ROUTE`: cleaned daily series of
+    `?stations=96001,96011&parameters=RR,Tavg&start=2020-01-01&end=2020-12-31
+    &format=csv|parquet`, streamed one batch of stations at a time. At most
+    MAX_CONCURRENT exports run per process, others get 503."""
+    import flask
+
+    exports = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+    @server.route(ROUTE)
+    def export():
+        try:
+            stations, parameters_export, start, end, file_format = parse_request(
+                flask.request.args, set(pydata.read_metadata().index), parameters
+            )
+        except ValueError as error:
+            return flask.Response(f"{error}\n", status=400, mimetype="text/plain")
+        if file_format == "parquet" and not HAS_PYARROW:
+            return flask.Response(
+                "parquet export needs pyarrow\n", status=400, mimetype="text/plain"
+            )
+
+        if not exports.acquire(blocking=False):
+            return flask.Response(
+                "too many exports running, try again later\n",
+                status=503,
+                mimetype="text/plain",
+                headers={"Retry-After": "10"},
+            )
+        # the slot is released when the response is closed, or here if it
+        # could not be built
+        try:
+            stream = stream_csv if file_format == "csv" else stream_parquet
+            response = flask.Response(
+                stream(stations, parameters_export, start, end),
+                mimetype=FORMATS[file_format],
+                headers={
+                    "Content-Disposition": "attachment; filename="
+                    + _file_name(parameters_export, start, end, file_format)
+                },
+            )
+            response.call_on_close(exports.release)
+        except BaseException:
+            exports.release()
+            raise
+        return response
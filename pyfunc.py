@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import numpy as np
+
+
+# DOWNSAMPLING
+def downsample_minmax(x, y, n_out):
+    """Keep min and max of y for each of n_out/2 buckets (in original order).
+
+    All-NaN buckets are kept as a single NaN point so gaps stay visible.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    n = y.size
+    n_bucket = n_out // 2
+    if n <= n_out or n_bucket < 1:
+        return x, y
+
+    size = -(-n // n_bucket)
+    n_bucket = -(-n // size)
+    y_pad = np.full(n_bucket * size, np.nan)
+    y_pad[:n] = y
+    y_pad = y_pad.reshape(n_bucket, size)
+
+    is_empty = np.isnan(y_pad).all(axis=1)
+    argmin = np.where(np.isnan(y_pad), np.inf, y_pad).argmin(axis=1)
+    argmax = np.where(np.isnan(y_pad), -np.inf, y_pad).argmax(axis=1)
+    offset = np.arange(n_bucket) * size
+    first = offset + np.minimum(argmin, argmax)
+    second = offset + np.maximum(argmin, argmax)
+    second[is_empty] = first[is_empty]
+
+    index = np.column_stack([first, second]).ravel()
+    index = index[np.r_[True, index[1:] != index[:-1]]]
+    index = index[index < n]
+    return x[index], y[index]
+
+
+def downsample_lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling. NaN points are dropped."""
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    is_valid = ~np.isnan(y)
+    x, y = x[is_valid], y[is_valid]
+    n = y.size
+    if n <= n_out or n_out < 3:
+        return x, y
+
+    if np.issubdtype(x.dtype, np.datetime64):
+        xv = x.astype("datetime64[ns]").astype(np.int64).astype(float)
+    else:
+        xv = x.astype(float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    index = np.empty(n_out, dtype=int)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < n_out - 1 else n
+        avg_x = xv[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (xv[a] - avg_x) * (y[start:end] - y[a])
+            - (xv[a] - xv[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        index[i + 1] = a
+    return x[index], y[index]
+
+
+DOWNSAMPLE_METHOD = {
+    "minmax": downsample_minmax,
+    "lttb": downsample_lttb,
+}
+
+
+def downsample_position(x, y, n_out):
+    """Keep n_out points evenly spaced by position, for values that are not
+    numbers (categories keep their labels)."""
+    x, y = np.asarray(x), np.asarray(y)
+    n = y.size
+    if n <= n_out or n_out < 1:
+        return x, y
+    index = np.unique(np.linspace(0, n - 1, n_out).round().astype(int))
+    return x[index], y[index]
+
+
+def downsample(x, y, n_out, method="minmax"):
+    if np.asarray(y).dtype.kind not in "biuf":
+        return downsample_position(x, y, n_out)
+    return DOWNSAMPLE_METHOD[method](x, y, n_out)
+
+
+def relayout_xrange(relayout):
+    """Return (start, end) of x axis from relayoutData.
+
+    (None, None) means autorange, False means x axis was not changed.
+    """
+    if not relayout:
+        return False
+    if "xaxis.range[0]" in relayout:
+        return relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]
+    if "xaxis.range" in relayout:
+        return tuple(relayout["xaxis.range"])
+    if relayout.get("xaxis.autorange"):
+        return None, None
+    return False
+
+
+def relayout_mapbox_bounds(relayout):
+    """Return (lat_min, lat_max, lon_min, lon_max) of map viewport from
+    relayoutData, False means map was not moved."""
+    if not relayout or "mapbox._derived" not in relayout:
+        return False
+    lon, lat = np.asarray(relayout["mapbox._derived"]["coordinates"], dtype=float).T
+    return lat.min(), lat.max(), lon.min(), lon.max()
+
+
+# SERIALIZATION
+def typed_array(values, dtype="f4"):
+    """plotly.js typed array (base64 of the little-endian buffer), decoded by
+    the browser without parsing numbers. float32 is enough for observations
+    (at most 7 significant digits); NaN stays a gap."""
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    spec = {"dtype": dtype, "bdata": base64.b64encode(values).decode("ascii")}
+    if values.ndim > 1:
+        spec["shape"] = ",".join(str(n) for n in values.shape)
+    return spec
+
+
+def iso_dates(values):
+    """ISO strings of datetime64 values, date only if all are at midnight."""
+    values = np.asarray(values, dtype="datetime64[ns]")
+    is_date = (values.astype("datetime64[D]") == values) | np.isnat(values)
+    return np.datetime_as_string(values, unit="D" if is_date.all() else "s").tolist()
+
+
+def encode_array(values):
+    """Dates as ISO strings, floats as typed array, anything else unchanged."""
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind == "M":
+            return iso_dates(values)
+        if values.dtype.kind == "f":
+            return typed_array(values)
+    return values
+
+
+def encode_trace(trace):
+    """Encode x, y and z of a trace dict in place (see encode_array)."""
+    for key in ["x", "y", "z"]:
+        if key in trace:
+            trace[key] = encode_array(trace[key])
+    return trace
+
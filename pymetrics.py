@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+
+# PARSE CONFIG
+CONFIG_PATH = "config.ini"
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+ENABLED = bool(int(config["METRICS"]["ENABLED"]))
+SERVER_TIMING = ENABLED and bool(int(config["METRICS"]["SERVER_TIMING"]))
+ROUTE = config["METRICS"]["ROUTE"]
+
+# HISTOGRAM BUCKETS (SECONDS)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    """Histograms and counters of this process, in Prometheus text format."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = histogram[0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self, gauges=()):
+        """Text exposition of every metric; `gauges` are extra
+        (name, type, labels, value) read at scrape time."""
+        families = {}  # SAMPLES OF ONE METRIC MUST BE CONTIGUOUS
+
+        def add(name, kind, labels, value, suffix=""):
+            samples = families.setdefault(name, (kind, []))[1]
+            samples.append(f"{name}{suffix}{_labels(labels)} {value}")
+
+        with self._lock:
+            histograms = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._histograms.items()
+            }
+            counters = dict(self._counters)
+
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            labels = dict(labels)
+            for bound, n in zip(self.buckets, counts):
+                add(name, "histogram", {**labels, "le": bound}, n, "_bucket")
+            add(name, "histogram", {**labels, "le": "+Inf"}, count, "_bucket")
+            add(name, "histogram", labels, total, "_sum")
+            add(name, "histogram", labels, count, "_count")
+        for (name, labels), value in sorted(counters.items()):
+            add(name, "counter", dict(labels), value)
+        for name, kind, labels, value in gauges:
+            add(name, kind, labels, value)
+
+        lines = []
+        for name, (kind, samples) in families.items():
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return f"{{{text}}}"
+
+
+registry = Registry()
+
+
+def _after_fork():
+    """New registry lock in a forked child (see pydata._after_fork)."""
+    registry._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+# SPANS OF THE CURRENT REQUEST (SERVER-TIMING), SHARED WITH POOL THREADS
+_request_spans = ContextVar("request_spans", default=None)
+_NOOP = nullcontext()
+
+
+@contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe("bmkg_span_seconds", seconds, span=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, seconds))
+
+
+def span(name):
+    """Time the block as stage `name`, no-op if metrics are disabled."""
+    return _span(name) if ENABLED else _NOOP
+
+
+def timed(name):
+    """Decorator version of span."""
+
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inc(name, value=1, **labels):
+    if ENABLED:
+        registry.inc(name, value, **labels)
+
+
+# POOLS: RUN TASKS IN THE CONTEXT OF THE SUBMITTING REQUEST
+def pool_submit(pool, func, *args):
+    if not ENABLED:
+        return pool.submit(func, *args)
+    return pool.submit(copy_context().run, func, *args)
+
+
+def pool_map(pool, func, iterable):
+    if not ENABLED:
+        return pool.map(func, iterable)
+    futures = [pool.submit(copy_context().run, func, item) for item in iterable]
+    return (future.result() for future in futures)
+
+
+# FLASK
+def init_flask(server, gauges=lambda: ()):
+    """Register `ROUTE` (Prometheus text format) and, with SERVER_TIMING, a
+    Server-Timing header with the spans of each request. Metrics are per
+    process, every gunicorn worker answers with its own."""
+    if not ENABLED:
+        return
+    import flask
+
+    @server.route(ROUTE)
+    def metrics():
+        return flask.Response(
+            registry.render(gauges()),
+            mimetype="text/plain; version=0.0.4",
+        )
+
+    @server.before_request
+    def start_request():
+        flask.g.metrics_start = time.perf_counter()
+        flask.g.metrics_spans = []
+        flask.g.metrics_token = _request_spans.set(flask.g.metrics_spans)
+
+    @server.after_request
+    def end_request(response):
+        seconds = time.perf_counter() - flask.g.metrics_start
+        rule = flask.request.url_rule
+        path = rule.rule if rule is not None else "other"  # bounded label values
+        registry.observe("bmkg_request_seconds", seconds, path=path)
+        spans = flask.g.metrics_spans
+        callbacks = sum(t for name, t in list(spans) if name.startswith("callback_"))
+        if callbacks:
+            # rest of a callback request is Dash dispatch and JSON encoding
+            registry.observe("bmkg_span_seconds", seconds - callbacks, span="dash")
+            spans.append(("dash", seconds - callbacks))
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = server_timing(spans, seconds)
+        return response
+
+    @server.teardown_request
+    def reset_request(_):
+        token = flask.g.pop("metrics_token", None)
+        if token is not None:
+            _request_spans.reset(token)
+
+
+def server_timing(spans, total):
+    """Server-Timing value: summed duration (ms) and count of every span."""
+    summary = {}
+    for name, seconds in list(spans):
+        duration, count = summary.get(name, (0.0, 0))
+        summary[name] = (duration + seconds, count + 1)
+    entries = [
+        f'{name};dur={duration * 1e3:.1f};desc="x{count}"'
+        for name, (duration, count) in summary.items()
+    ]
+    entries.append(f"total;dur={total * 1e3:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine(lat, lon, lats, lons):
+    """Great-circle distance (km) from (lat, lon) to each of (lats, lons)."""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class StationIndex:
+    """Grid bucketing of station coordinates (degrees).
+
+    Stations are sorted by cell, so the stations of one cell are a contiguous
+    slice and a box query only touches the cells it overlaps. Stations without
+    coordinates are left out. Longitudes are not wrapped around 180°.
+    """
+
+    def __init__(self, ids, lat, lon, cell_deg=1.0):
+        ids = np.asarray(ids)
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        is_valid = ~(np.isnan(lat) | np.isnan(lon))
+        ids, lat, lon = ids[is_valid], lat[is_valid], lon[is_valid]
+
+        self.cell_deg = cell_deg
+        self.origin = (lat.min(), lon.min()) if lat.size else (0.0, 0.0)
+        row, col = self._cell(lat, lon)
+        self.n_row = int(row.max()) + 1 if lat.size else 1
+        self.n_col = int(col.max()) + 1 if lat.size else 1
+
+        cell = row * self.n_col + col
+        order = np.argsort(cell, kind="stable")
+        self.ids = ids[order]
+        self.lat = lat[order]
+        self.lon = lon[order]
+        # STATIONS OF CELL c ARE [starts[c], starts[c + 1])
+        self.starts = np.searchsorted(
+            cell[order], np.arange(self.n_row * self.n_col + 1)
+        )
+
+    def _cell(self, lat, lon):
+        row = np.floor((np.asarray(lat) - self.origin[0]) / self.cell_deg)
+        col = np.floor((np.asarray(lon) - self.origin[1]) / self.cell_deg)
+        return row.astype(int), col.astype(int)
+
+    def __len__(self):
+        return self.ids.size
+
+    def _positions_box(self, lat_min, lat_max, lon_min, lon_max):
+        (row_min, col_min), (row_max, col_max) = (
+            self._cell(lat_min, lon_min),
+            self._cell(lat_max, lon_max),
+        )
+        row_min, col_min = max(row_min, 0), max(col_min, 0)
+        row_max, col_max = min(row_max, self.n_row - 1), min(col_max, self.n_col - 1)
+        if row_min > row_max or col_min > col_max:
+            return np.empty(0, dtype=int)
+
+        # EACH GRID ROW IS ONE CONTIGUOUS RUN OF CELLS
+        rows = np.arange(row_min, row_max + 1) * self.n_col
+        starts = self.starts[rows + col_min]
+        ends = self.starts[rows + col_max + 1]
+        positions = np.concatenate(
+            [np.arange(start, end) for start, end in zip(starts, ends)]
+        )
+        lat, lon = self.lat[positions], self.lon[positions]
+        is_inside = (
+            (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        )
+        return positions[is_inside]
+
+    def within_box(self, lat_min, lat_max, lon_min, lon_max, limit=None):
+        """Positions of stations inside the box, at most `limit` of them.
+
+        Over the limit, stations are taken evenly in cell order so the
+        selection stays spread over the box.
+        """
+        positions = self._positions_box(lat_min, lat_max, lon_min, lon_max)
+        return thin(positions, limit)
+
+    def within_radius(self, lat, lon, radius_km):
+        """Positions of stations within `radius_km`, nearest first."""
+        lat_deg = radius_km / KM_PER_DEGREE
+        cos_lat = max(np.cos(np.radians(abs(lat) + lat_deg)), 1e-6)
+        lon_deg = min(lat_deg / cos_lat, 180)
+        positions = self._positions_box(
+            lat - lat_deg, lat + lat_deg, lon - lon_deg, lon + lon_deg
+        )
+        distance = haversine(lat, lon, self.lat[positions], self.lon[positions])
+        order = np.argsort(distance, kind="stable")
+        return positions[order][distance[order] <= radius_km]
+
+    def nearest(self, lat, lon, n):
+        """Positions of the n stations nearest to (lat, lon), nearest first."""
+        n = min(n, len(self))
+        if n < 1:
+            return np.empty(0, dtype=int)
+
+        # GROW A RING OF CELLS UNTIL IT HOLDS n CANDIDATES, THEN THE n-TH
+        # CANDIDATE DISTANCE BOUNDS THE RADIUS HOLDING THE TRUE n NEAREST
+        ring = 0
+        while True:
+            half = (ring + 0.5) * self.cell_deg
+            positions = self._positions_box(
+                lat - half, lat + half, lon - half, lon + half
+            )
+            if positions.size >= n:
+                break
+            ring += 1
+        distance = haversine(lat, lon, self.lat[positions], self.lon[positions])
+        radius_km = np.partition(distance, n - 1)[n - 1]
+        return self.within_radius(lat, lon, radius_km)[:n]
+
+
+def thin(positions, limit):
+    """At most `limit` items of positions, taken evenly."""
+    if limit is None or positions.size <= limit:
+        return positions
+    return positions[np.linspace(0, positions.size - 1, limit).astype(int)]
@@ -1,3 +1,4 @@
+import functools
 import plotly.io as pio
 import plotly.graph_objects as go
 import configparser
@@ -16,137 +17,154 @@ SOURCE_IMAGE = None
 BASED_TEMPLATE = "plotly"
 HEATMAP_COLOR = "Blackbody"  # Viridis, Blackbody, Plasma, Blues, Aggrnyl
 
-# TEMPLATE BASED ON
-hktemplate = pio.templates[BASED_TEMPLATE]
+# TEMPLATE
+def build_hktemplate():
+    """Return hktemplate, a copy of BASED_TEMPLATE with the dashboard style."""
+    # TEMPLATE BASED ON
+    hktemplate = go.layout.Template(pio.templates[BASED_TEMPLATE])
 
-# GENERAL LAYOUT
-hktemplate.layout.hovermode = "x"
-hktemplate.layout.images = [
-    dict(
-        source=SOURCE_IMAGE,
+    # GENERAL LAYOUT
+    hktemplate.layout.hovermode = "x"
+    hktemplate.layout.images = [
+        dict(
+            source=SOURCE_IMAGE,
+            xref="paper",
+            yref="paper",
+            x=1,
+            y=1.05,
+            sizex=0.1,
+            sizey=0.2,
+            xanchor="right",
+            yanchor="bottom",
+            name="logo-hidrokit",
+        )
+    ]
+    hktemplate.layout.title = dict(
+        xanchor="left",
+        yanchor="top",
+        x=0,
+        y=1,
         xref="paper",
         yref="paper",
-        x=1,
-        y=1.05,
-        sizex=0.1,
-        sizey=0.2,
-        xanchor="right",
-        yanchor="bottom",
-        name="logo-hidrokit",
+        font={"size": 20},
     )
-]
-hktemplate.layout.title = dict(
-    xanchor="left",
-    yanchor="top",
-    x=0,
-    y=1,
-    xref="paper",
-    yref="paper",
-    font={"size": 20},
-)
-hktemplate.layout.margin = dict(l=0, r=0, b=0)
-hktemplate.layout.mapbox = dict(
-    bearing=0,
-    style="stamen-watercolor",
-    zoom=4.5,
-    pitch=100,
-    accesstoken=MAPBOX_TOKEN,
-)
-hktemplate.layout.height = 500  # only affects map
-hktemplate.layout.showlegend = False
-hktemplate.layout.font = {"family": "Neucha"}
-hktemplate.layout.hoverlabel = {"font_family": "Neucha"}
-hktemplate.layout.xaxis = {
-    "showline": True,
-    "linewidth": 2,
-    "linecolor": "black",
-    "mirror": True,
-    "automargin": True,
-    "gridcolor": "#bdbdbd",
-    "spikecolor": "Dodgerblue",
-    "spikethickness": 1,
-    "spikemode": "across",
-    "spikedash": "solid",
-}
-hktemplate.layout.yaxis = {
-    "showline": True,
-    "linewidth": 2,
-    "linecolor": "black",
-    "mirror": True,
-    "automargin": True,
-    "gridcolor": "#bdbdbd",
-    "zerolinecolor": "#bdbdbd",
-    "zerolinewidth": 2,
-    "rangemode": "tozero",
-    "spikecolor": "Dodgerblue",
-    "spikethickness": 2,
-    "spikedash": "solid",
-}
-hktemplate.layout.xaxis.title = {"font": {"size": 20}, "standoff": 15}
-hktemplate.layout.yaxis.title = {"font": {"size": 15}, "standoff": 15}
-hktemplate.layout.legend = {
-    "yanchor": "top",
-    "y": 1,
-    "xanchor": "left",
-    "x": 0,
-    "orientation": "h",
-    # "bgcolor": "rgba(0,0,0,0)",
-    "bgcolor": "rgba(250, 240, 230, 0.5)",
-    "font": {"size": 15},
-}
-hktemplate.layout.paper_bgcolor = "white"
-hktemplate.layout.plot_bgcolor = "white"
-
-# SPECIFIC PLOT
-# SCATTERMAPBOX
-hktemplate.data.scattermapbox = [
-    go.Scattermapbox(
-        mode="markers",
-        # marker=go.scattermapbox.Marker(size=10, color="DodgerBlue"),
-        marker={
-            "size": 15,
-            "color": "FireBrick",
-            "opacity": 0.9,
-        },
-        hovertemplate="%{customdata} - %{text}<br>(%{lat:.5f}, %{lon:.5f})<extra></extra>",
-        hoverlabel={
-            "font_family": "Neucha",
-            "bgcolor": "Tomato",
-            "bordercolor": "FireBrick",
-            "font": {"color": "white", "size": 15},
-            "align": "right",
-            "namelength": 5,
-        },
-        line={"width": 2, "color": "black"},
+    hktemplate.layout.margin = dict(l=0, r=0, b=0)
+    hktemplate.layout.mapbox = dict(
+        bearing=0,
+        style="stamen-watercolor",
+        zoom=4.5,
+        pitch=100,
+        accesstoken=MAPBOX_TOKEN,
     )
-]
+    hktemplate.layout.height = 500  # only affects map
+    hktemplate.layout.showlegend = False
+    hktemplate.layout.font = {"family": "Neucha"}
+    hktemplate.layout.hoverlabel = {"font_family": "Neucha"}
+    hktemplate.layout.xaxis = {
+        "showline": True,
+        "linewidth": 2,
+        "linecolor": "black",
+        "mirror": True,
+        "automargin": True,
+        "gridcolor": "#bdbdbd",
+        "spikecolor": "Dodgerblue",
+        "spikethickness": 1,
+        "spikemode": "across",
+        "spikedash": "solid",
+    }
+    hktemplate.layout.yaxis = {
+        "showline": True,
+        "linewidth": 2,
+        "linecolor": "black",
+        "mirror": True,
+        "automargin": True,
+        "gridcolor": "#bdbdbd",
+        "zerolinecolor": "#bdbdbd",
+        "zerolinewidth": 2,
+        "rangemode": "tozero",
+        "spikecolor": "Dodgerblue",
+        "spikethickness": 2,
+        "spikedash": "solid",
+    }
+    hktemplate.layout.xaxis.title = {"font": {"size": 20}, "standoff": 15}
+    hktemplate.layout.yaxis.title = {"font": {"size": 15}, "standoff": 15}
+    hktemplate.layout.legend = {
+        "yanchor": "top",
+        "y": 1,
+        "xanchor": "left",
+        "x": 0,
+        "orientation": "h",
+        # "bgcolor": "rgba(0,0,0,0)",
+        "bgcolor": "rgba(250, 240, 230, 0.5)",
+        "font": {"size": 15},
+    }
+    hktemplate.layout.paper_bgcolor = "white"
+    hktemplate.layout.plot_bgcolor = "white"
 
-# HEATMAP
-hktemplate.data.heatmap = [
-    go.Heatmap(
-        colorscale=HEATMAP_COLOR,
-        textfont={"family": "Neucha"},
-        colorbar={
-            "orientation": "v",
-            "outlinecolor": "black",
-            "outlinewidth": 2,
-            "ticksuffix": "%",
-            "x": 1,
-            "xpad": 10,
-            "y": 0.5,
-            "ypad": 0,
-            # "title": {
-            #     "font": {"color": "black", "size": 20},
-            #     "side": "top",
-            #     "text": "💯",
-            # },  # BUGGED
-        },
-        hovertemplate="📅: %{customdata}<br>🆔: %{y}<br>💯: %{z}%<extra></extra>",
-        hoverlabel={"bordercolor": "black", "font": {"color": "white"}},
-    )
-]
+    # SPECIFIC PLOT
+    # SCATTERMAPBOX
+    hktemplate.data.scattermapbox = [
+        go.Scattermapbox(
+            mode="markers",
+            # marker=go.scattermapbox.Marker(size=10, color="DodgerBlue"),
+            marker={
+                "size": 15,
+                "color": "FireBrick",
+                "opacity": 0.9,
+            },
+            hovertemplate="%{customdata} - %{text}<br>(%{lat:.5f}, %{lon:.5f})<extra></extra>",
+            hoverlabel={
+                "font_family": "Neucha",
+                "bgcolor": "Tomato",
+                "bordercolor": "FireBrick",
+                "font": {"color": "white", "size": 15},
+                "align": "right",
+                "namelength": 5,
+            },
+            line={"width": 2, "color": "black"},
+        )
+    ]
+
+    # HEATMAP
+    hktemplate.data.heatmap = [
+        go.Heatmap(
+            colorscale=HEATMAP_COLOR,
+            textfont={"family": "Neucha"},
+            colorbar={
+                "orientation": "v",
+                "outlinecolor": "black",
+                "outlinewidth": 2,
+                "ticksuffix": "%",
+                "x": 1,
+                "xpad": 10,
+                "y": 0.5,
+                "ypad": 0,
+                # "title": {
+                #     "font": {"color": "black", "size": 20},
+                #     "side": "top",
+                #     "text": "💯",
+                # },  # BUGGED
+            },
+            hovertemplate="📅: %{x|%B %Y}<br>🆔: %{y}<br>💯: %{z}%<extra></extra>",
+            hoverlabel={
+                "bordercolor": "black",
+                "font": {"color": "white", "textcase": "lower"},
+            },
+        )
+    ]
+
+    hktemplate.data.scatter = [go.Scatter(mode="lines")]
+
+    return hktemplate
+
+
+@functools.cache
+def setup_template():
+    """Register hktemplate as default plotly template. Built on first call, so
+    importing this module does not touch plotly templates."""
+    pio.templates["hktemplate"] = build_hktemplate()
+    pio.templates.default = "hktemplate"
 
-hktemplate.data.scatter = [go.Scatter(mode="lines")]
 
 emtpy_fig = go.Figure(
     data=[{"x": [], "y": []}],